@@ -1,10 +1,12 @@
 import os
 import cv2
 import face_recognition
-import numpy as np
 from tqdm import tqdm
-import time
 import pickle
+import argparse
+from gallery import Gallery, as_gallery
+from tracker import FaceTracker
+from instrument import Instrumentation, add_arguments
 import gspread
 
 class Face:
@@ -44,13 +46,11 @@ def detect_faces(image_test, faces, threshold=0.6, unknown_threshold=0.55):
     name_percentages = {}
     unknown_detected = False
 
-    for loc_test, vec_test in zip(locs_test, vecs_test):
-        distances = []
-        for face in faces:
-            distance = face_recognition.face_distance([vec_test], face.feature_vector)
-            distances.append(distance)
+    gallery = as_gallery(faces)
+    pred_names, min_distances = gallery.match(vecs_test, k=1)
 
-        min_distance = np.min(distances)
+    for loc_test, names, distances in zip(locs_test, pred_names, min_distances):
+        min_distance = distances[0]
         match_percentage = (1 - min_distance) * 100  # Convert distance to percentage match
 
         if match_percentage / 100 < threshold:
@@ -61,8 +61,7 @@ def detect_faces(image_test, faces, threshold=0.6, unknown_threshold=0.55):
                 pred_name = 'Unknown Face Detected'
                 unknown_detected = True
             else:
-                pred_index = np.argmin(distances)
-                pred_name = faces[pred_index].name
+                pred_name = names[0]
 
             # Update counts and percentages
             if pred_name not in name_counts:
@@ -133,6 +132,10 @@ def load_database():
         return []
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webcam recognition with tracking between keyframes")
+    add_arguments(parser, report_interval=0)
+    args = parser.parse_args()
+
     # Load or create the face database
     faces = load_database()
 
@@ -144,49 +147,44 @@ if __name__ == "__main__":
         # Save the database for future use
         save_database(faces)
 
+    gallery = Gallery.from_faces(faces)
+    tracker = FaceTracker(gallery, keyframe_interval=10, threshold=0.6)
+
     # Open webcam
     cap = cv2.VideoCapture(0)
     cap.set(3, 640)
     cap.set(4, 480)
 
-    frame_count = -1
-    prev_frame_time = 0
-    total_frame_time = []
+    instrumentation = Instrumentation.from_args(args).start()
+    metrics = instrumentation.metrics
 
     while True:
-        start_time = time.time()
-
-        ret, image = cap.read()
+        with metrics.timer('capture'):
+            ret, image = cap.read()
 
         if ret:
-            # Calculate the time taken to capture each frame
-            frame_time = time.time() - prev_frame_time
-            prev_frame_time = time.time()
-
-            total_frame_time.append(frame_time)
-
-            image_display = image.copy()  # Create a copy for display
-
-            # Process every 10th frame
-            if frame_count % 10 == 0:
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-                image = detect_faces(image, faces, threshold=0.6)
-
-            # Show the output image
-            cv2.imshow('image', image_display)
-
-            # Print the time taken to capture each frame
-            print("Time taken for each frame:", frame_time)
-
-        frame_count += 1
+            with metrics.timer('frame'):
+                # Full detection every 10th frame, faces are tracked in between
+                with metrics.timer('convert'):
+                    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                with metrics.timer('track'):
+                    results = tracker.process(image)
+                metrics.count('faces_seen', len(results))
+                with metrics.timer('draw'):
+                    for loc_test, pred_name, match_percentage in results:
+                        image = draw_bounding_box(image, loc_test)
+                        image = draw_name(image, loc_test, pred_name)
+                    image_display = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+                # Show the output image
+                with metrics.timer('display'):
+                    cv2.imshow('image', image_display)
 
         # Break the loop if 'q' is pressed
         if cv2.waitKey(1) & 0xFF == ord('q'):
-            
-            total_frame_time.remove(total_frame_time[0])
-
-            print("Average frame time:", sum(total_frame_time) / frame_count)
+            instrumentation.stop()
+            print(metrics.log_line())
+            print("Tracker stats:", tracker.stats())
             break
     
     # Release the webcam and close all windows
@@ -0,0 +1,193 @@
+import os
+import csv
+import json
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+import cv2
+from faceid import recognize_faces, sync_database, load_database, build_gallery, VoteAccumulator
+from store import FaceStore, STORE_DIRNAME
+from instrument import NullMetrics, Instrumentation, add_arguments
+from cache import EmbeddingCache
+
+_gallery = None
+_cache_ttl = None
+_caches = {}
+_video_time = 0.0
+
+def init_worker(cache_ttl=None):
+    # Each worker maps the same on-disk store, so the gallery lives in the page cache once.
+    # The parent has already migrated the store and written the index, workers only load them
+    global _gallery, _cache_ttl
+    cv2.setNumThreads(1)
+    _gallery = build_gallery(FaceStore.open(STORE_DIRNAME))
+    _cache_ttl = cache_ttl
+
+def video_time():
+    return _video_time
+
+def recognize_frame(task):
+    # With a cache each worker keeps one EmbeddingCache per input, expiring on video time
+    global _video_time
+    source, frame_index, timestamp, image, threshold, unknown_threshold, detect_scale = task
+    start = time.perf_counter()
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    cache = None
+    if _cache_ttl is not None:
+        _video_time = timestamp
+        cache = _caches.get(source)
+        if cache is None:
+            cache = _caches[source] = EmbeddingCache(ttl=_cache_ttl, clock=video_time)
+        hits, misses = cache.hits, cache.misses
+    encoded = []
+    results = recognize_faces(rgb, _gallery, threshold, unknown_threshold, detect_scale, cache, encoded=encoded)
+    lookups = (cache.hits - hits, cache.misses - misses) if cache is not None else (0, 0)
+    return source, frame_index, timestamp, results, encoded, time.perf_counter() - start, lookups
+
+def read_video(path, stride, start, end):
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    if start:
+        cap.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+    frame_index = int(round(start * fps)) if start else 0
+    while True:
+        # grab() skips decoding for frames the stride drops
+        if not cap.grab():
+            break
+        timestamp = frame_index / fps
+        if end is not None and timestamp > end:
+            break
+        if frame_index % stride == 0:
+            ret, image = cap.retrieve()
+            if ret:
+                yield frame_index, timestamp, image
+        frame_index += 1
+    cap.release()
+
+def read_folder(path, stride, start, end, fps):
+    for frame_index, filename in enumerate(sorted(os.listdir(path))):
+        timestamp = frame_index / fps
+        if timestamp < (start or 0) or frame_index % stride:
+            continue
+        if end is not None and timestamp > end:
+            break
+        image = cv2.imread(os.path.join(path, filename))
+        if image is not None:
+            yield frame_index, timestamp, image
+
+def read_inputs(inputs, tasks, stride, start, end, fps, options):
+    # Reader thread: decodes frames and queues them for the pool
+    for source in inputs:
+        frames = read_folder(source, stride, start, end, fps) if os.path.isdir(source) else read_video(source, stride, start, end)
+        for frame_index, timestamp, image in frames:
+            tasks.put((source, frame_index, timestamp, image) + options)
+    tasks.put(None)
+
+def iter_tasks(tasks, in_flight):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        # Bounds the frames handed to the pool, imap would otherwise read the whole input ahead
+        in_flight.acquire()
+        yield task
+
+def process(inputs, jsonl_path=None, csv_path=None, processes=None, stride=1, start=None, end=None, fps=30.0,
+            threshold=0.6, unknown_threshold=0.55, min_frames=20, detect_scale=1.0, metrics=None, cache_ttl=None,
+            folder=None):
+    metrics = metrics if metrics is not None else NullMetrics()
+    # Once here rather than in every worker, which would all migrate, train and write the index at once
+    build_gallery(sync_database(folder) if folder else load_database())
+    processes = processes or multiprocessing.cpu_count()
+    tasks = queue.Queue(maxsize=processes * 4)
+    in_flight = threading.Semaphore(processes * 4)
+    reader = threading.Thread(target=read_inputs, daemon=True,
+                              args=(inputs, tasks, stride, start, end, fps, (threshold, unknown_threshold, detect_scale)))
+    reader.start()
+
+    # Recordings are one session however long they take to process, never split them at midnight
+    votes = VoteAccumulator(threshold, min_frames, today=None)
+    first_seen = {}
+    frames = 0
+    cache_hits = cache_misses = 0
+    started_at = time.perf_counter()
+    jsonl = open(jsonl_path, 'w') if jsonl_path else None
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(cache_ttl,)) as pool:
+        # imap keeps input order and votes decay on video time, so they accumulate exactly as they would live
+        for source, frame_index, timestamp, results, encoded, elapsed, (hits, misses) in pool.imap(
+                recognize_frame, iter_tasks(tasks, in_flight)):
+            in_flight.release()
+            frames += 1
+            cache_hits += hits
+            cache_misses += misses
+            metrics.count('cache_hits', hits)
+            metrics.count('cache_misses', misses)
+            # Worker time per frame, the pool runs `processes` of these at once
+            metrics.observe('recognize', elapsed)
+            metrics.count('frames')
+            metrics.count('faces_seen', len(results))
+            with metrics.timer('vote'):
+                # Cache hits repeat an earlier match, only fresh encodings count
+                votes.update(encoded, now=timestamp)
+            for loc_test, pred_name, match_percentage in results:
+                first_seen.setdefault(pred_name, (source, timestamp))
+            if jsonl:
+                jsonl.write(json.dumps({'source': source, 'frame': frame_index, 'time': round(timestamp, 3),
+                                        'faces': [{'box': [int(v) for v in loc_test], 'name': pred_name,
+                                                   'match': round(float(match_percentage), 2)}
+                                                  for loc_test, pred_name, match_percentage in results]}) + '\n')
+    if jsonl:
+        jsonl.close()
+
+    elapsed = time.perf_counter() - started_at
+    print(f"Processed {frames} frames in {elapsed:.1f} s ({frames / elapsed if elapsed else 0:.1f} frames/s, {processes} processes)")
+    if cache_ttl is not None:
+        lookups = cache_hits + cache_misses
+        # Frames are spread over the workers and each caches only what it saw, fewer processes hit more often
+        print(f"Embedding cache: {cache_hits} hits, {cache_misses} misses "
+              f"({cache_hits / lookups if lookups else 0:.0%}) across {processes} workers")
+
+    attendance = votes.attendance()
+    if csv_path:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'frames', 'first_source', 'first_seen_s'])
+            for name in attendance:
+                source, timestamp = first_seen[name]
+                writer.writerow([name, votes.confirmed[name]['votes'], source, round(timestamp, 3)])
+    return attendance
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild attendance from recorded video files or frame folders")
+    parser.add_argument('inputs', nargs='+', help="video files or folders of frames")
+    parser.add_argument('--jsonl', help="write per-frame detections here")
+    parser.add_argument('--csv', help="write the final attendance here")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--stride', type=int, default=1, help="process every Nth frame")
+    parser.add_argument('--start', type=float, default=None, help="seconds into each input")
+    parser.add_argument('--end', type=float, default=None, help="seconds into each input")
+    parser.add_argument('--fps', type=float, default=30.0, help="frame rate assumed for frame folders")
+    parser.add_argument('--folder', default='known_faces', help="synced into the store before processing, '' to skip")
+    parser.add_argument('--min-frames', type=int, default=20)
+    parser.add_argument('--detect-scale', type=float, default=1.0)
+    parser.add_argument('--cache', action='store_true', help="reuse encodings of faces unchanged since the worker's last frame")
+    parser.add_argument('--cache-ttl', type=float, default=2.0, help="video seconds before a cached encoding is redone")
+    add_arguments(parser, report_interval=0)
+    args = parser.parse_args()
+
+    instrumentation = Instrumentation.from_args(args).start()
+    try:
+        attendance = process(args.inputs, args.jsonl, args.csv, args.processes, args.stride, args.start, args.end,
+                             args.fps, min_frames=args.min_frames, detect_scale=args.detect_scale,
+                             metrics=instrumentation.metrics, cache_ttl=args.cache_ttl if args.cache else None,
+                             folder=args.folder)
+    finally:
+        instrumentation.stop()
+    if instrumentation.metrics.enabled:
+        print(instrumentation.metrics.log_line())
+    print("Attendance:", attendance)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import time
+import numpy as np
+from index import BruteForceIndex, IVFIndex
+
+def synthetic_gallery(n_identities, n_queries, dim=128, spread=0.05, seed=0):
+    # Roughly mimics dlib encodings: identities scattered in a ball, probes are
+    # noisy re-captures of enrolled identities
+    rng = np.random.default_rng(seed)
+    gallery = rng.normal(0, 0.1, size=(n_identities, dim)).astype(np.float32)
+    targets = rng.integers(0, n_identities, size=n_queries)
+    queries = gallery[targets] + rng.normal(0, spread, size=(n_queries, dim)).astype(np.float32)
+    return gallery, queries.astype(np.float32)
+
+def time_search(index, queries, k, batch):
+    start = time.perf_counter()
+    ids = []
+    for i in range(0, len(queries), batch):
+        ids.append(index.search(queries[i:i + batch], k)[0])
+    elapsed = time.perf_counter() - start
+    return np.concatenate(ids), elapsed / len(queries) * 1000
+
+def recall(approx_ids, exact_ids):
+    hits = [len(set(a) & set(e)) / len(e) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits))
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency of the IVF index against brute force")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=4, help="faces scored per call, roughly faces per frame")
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'index':>10} {'n_probe':>8} {'recall@k':>9} {'ms/query':>9} {'build s':>8}")
+    for size in args.sizes:
+        gallery, queries = synthetic_gallery(size, args.queries)
+
+        exact = BruteForceIndex().build(gallery)
+        exact_ids, exact_ms = time_search(exact, queries, args.k, args.batch)
+        print(f"{size:>8} {'brute':>10} {'-':>8} {1.0:>9.3f} {exact_ms:>9.3f} {0.0:>8.2f}")
+
+        start = time.perf_counter()
+        ivf = IVFIndex().build(gallery)
+        build_time = time.perf_counter() - start
+        for n_probe in args.n_probe:
+            ivf.n_probe = n_probe
+            ids, ms = time_search(ivf, queries, args.k, args.batch)
+            print(f"{size:>8} {'ivf':>10} {n_probe:>8} {recall(ids, exact_ids):>9.3f} {ms:>9.3f} {build_time:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import time
+import argparse
+import numpy as np
+import cv2
+import face_recognition
+from faceid import load_image, detect_locations
+from tracker import iou
+
+def record_frames(folder, count, camera=0):
+    os.makedirs(folder, exist_ok=True)
+    cap = cv2.VideoCapture(camera)
+    cap.set(3, 640)
+    cap.set(4, 480)
+    saved = 0
+    while saved < count:
+        ret, image = cap.read()
+        if ret:
+            cv2.imwrite(os.path.join(folder, f'frame_{saved:04d}.png'), image)
+            saved += 1
+    cap.release()
+    print(f"Recorded {saved} frames to {folder}")
+
+def matched(reference, candidates, min_iou):
+    return sum(1 for ref in reference if any(iou(ref, loc) >= min_iou for loc in candidates))
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection latency/recall at several detection scales")
+    parser.add_argument('frames', help="folder of recorded frames")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.75, 0.5, 0.35, 0.25])
+    parser.add_argument('--min-iou', type=float, default=0.5)
+    parser.add_argument('--record', type=int, default=0, help="record this many webcam frames into the folder first")
+    args = parser.parse_args()
+
+    if args.record:
+        record_frames(args.frames, args.record)
+
+    frames = [load_image(os.path.join(args.frames, name)) for name in sorted(os.listdir(args.frames))]
+    # Full-resolution detections are the reference the smaller scales are scored against
+    reference = [detect_locations(frame, 1.0) for frame in frames]
+    total_faces = sum(len(locs) for locs in reference)
+    print(f"{len(frames)} frames, {total_faces} faces at scale 1.0")
+
+    print(f"{'scale':>6} {'detect ms':>10} {'encode ms':>10} {'recall':>7} {'faces':>6}")
+    for scale in args.scales:
+        detect_times, encode_times, found, hits = [], [], 0, 0
+        for frame, ref in zip(frames, reference):
+            start = time.perf_counter()
+            locs = detect_locations(frame, scale)
+            detect_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            face_recognition.face_encodings(frame, locs, num_jitters=1)
+            encode_times.append(time.perf_counter() - start)
+
+            found += len(locs)
+            hits += matched(ref, locs, args.min_iou)
+        recall = hits / total_faces if total_faces else float('nan')
+        print(f"{scale:>6.2f} {np.mean(detect_times) * 1000:>10.1f} {np.mean(encode_times) * 1000:>10.1f} {recall:>7.3f} {found:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import cv2
+from faceid import load_image, detect_locations, encode_locations, encode_images, build_gallery
+from gallery import IdentityGallery
+from index import make_index
+from store import FaceStore, list_images
+from bench_index import synthetic_gallery
+
+def generated_frames(count, width=640, height=480, seed=0):
+    # Fixed-seed stand-ins for camera frames when no recording is given, HOG still scans
+    # every pixel so detection cost is realistic even though they hold no faces
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        frame = np.tile(np.linspace(40, 200, width, dtype=np.uint8), (height, 1))
+        frame = np.dstack([frame] * 3) + rng.integers(0, 30, size=(height, width, 3), dtype=np.uint8)
+        for _ in range(5):
+            x, y = rng.integers(0, width - 100), rng.integers(0, height - 100)
+            cv2.ellipse(frame, (int(x) + 50, int(y) + 50), (40, 55), 0, 0, 360, [int(v) for v in rng.integers(0, 255, 3)], -1)
+        frames.append(frame)
+    return frames
+
+def load_frames(folder, limit):
+    names = sorted(name for name in os.listdir(folder) if not name.startswith('.'))[:limit]
+    return [load_image(os.path.join(folder, name)) for name in names]
+
+def center_box(frame):
+    # Encoding is timed on a fixed box when detection finds nothing, dlib's cost barely depends on content
+    height, width = frame.shape[:2]
+    size = min(height, width) // 2
+    top, left = (height - size) // 2, (width - size) // 2
+    return [(top, left + size, top + size, left)]
+
+def median_time(func, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+def bench_frames(frames, repeats, detect_scale):
+    locs = [detect_locations(frame, detect_scale) or center_box(frame) for frame in frames]
+    faces = sum(len(l) for l in locs)
+    detect = median_time(lambda: [detect_locations(frame, detect_scale) for frame in frames], repeats)
+    encode = median_time(lambda: [encode_locations(frame, l) for frame, l in zip(frames, locs)], repeats)
+    return {'detect.ms_per_frame': detect / len(frames) * 1000,
+            'encode.ms_per_face': encode / faces * 1000}
+
+def bench_gallery(size, queries, batch, repeats, workdir):
+    # Times the IdentityGallery path build_gallery gives production, centroid index then rerank
+    encodings, probes = synthetic_gallery(size, queries)
+    names = [f'person_{i}' for i in range(size)]
+    results = {}
+
+    gallery = IdentityGallery(names, encodings)
+    for kind in ('brute', 'ivf'):
+        start = time.perf_counter()
+        gallery.index = make_index(kind).build(gallery.encodings)
+        results[f'index_build.{kind}.{size}.ms'] = (time.perf_counter() - start) * 1000
+        elapsed = median_time(lambda: [gallery.search(probes[i:i + batch], 1)
+                                       for i in range(0, len(probes), batch)], repeats)
+        results[f'match.{kind}.{size}.ms_per_query'] = elapsed / len(probes) * 1000
+
+    path = os.path.join(workdir, f'store_{size}')
+    def save():
+        shutil.rmtree(path, ignore_errors=True)
+        store = FaceStore(path)
+        for name, vec in zip(names, encodings):
+            store.add(name, vec)
+        store.save()
+    results[f'db_save.{size}.ms'] = median_time(save, repeats) * 1000
+    # The first build groups the store and writes its layout, every later one maps it
+    start = time.perf_counter()
+    build_gallery(FaceStore.open(path), index_kind='brute')
+    results[f'gallery_build.{size}.ms'] = (time.perf_counter() - start) * 1000
+    results[f'db_load.{size}.ms'] = median_time(lambda: build_gallery(FaceStore.open(path), index_kind='brute'),
+                                                repeats) * 1000
+    return results
+
+def bench_enrol(folder, limit, processes, workdir):
+    # Enrolment only encodes images where HOG finds a face. The generated frames have none,
+    # so without a folder of real photos the number is HOG failing to find anything and
+    # is reported under its own key, never compared against a run that encoded faces.
+    if folder and os.path.isdir(folder):
+        paths = [os.path.join(folder, name) for name in list_images(folder)[:limit]]
+    else:
+        paths = []
+        for i, frame in enumerate(generated_frames(limit, seed=1)):
+            paths.append(os.path.join(workdir, f'enrol_{i}.png'))
+            cv2.imwrite(paths[-1], frame)
+    if not paths:
+        return {}
+    start = time.perf_counter()
+    faces = sum(1 for path, face, elapsed in encode_images(paths, processes) if face is not None)
+    elapsed = time.perf_counter() - start
+    if not faces:
+        print(f"No faces in the {len(paths)} enrolment images, timing detection only (enrol.detect_only)")
+        return {'enrol.detect_only.ms_per_image': elapsed / len(paths) * 1000}
+    return {'enrol.ms_per_image': elapsed / len(paths) * 1000, 'enrol.ms_per_face': elapsed / faces * 1000}
+
+def compare(results, baseline, tolerance, min_delta_ms=0.01):
+    # Every metric is a time in ms, more than `tolerance` above the baseline is a
+    # regression unless the difference is too small to be more than timer noise
+    rows, regressions = [], []
+    for key in sorted(set(results) & set(baseline)):
+        old, new = baseline[key], results[key]
+        change = (new - old) / old if old else 0.0
+        rows.append((key, old, new, change))
+        if change > tolerance and new - old > min_delta_ms:
+            regressions.append(key)
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of detection, encoding, matching, database load and enrolment")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help="synthetic gallery sizes")
+    parser.add_argument('--frames', help="folder of recorded frames, generated frames are used otherwise")
+    parser.add_argument('--frame-count', type=int, default=20)
+    parser.add_argument('--detect-scale', type=float, default=1.0)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=4, help="faces scored per call, roughly faces per frame")
+    parser.add_argument('--enrol', default='known_faces',
+                        help="folder of face photos to enrol, generated frames time detection only")
+    parser.add_argument('--enrol-count', type=int, default=20)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help="earlier --output to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed slowdown before a metric is flagged")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames, args.frame_count) if args.frames else generated_frames(args.frame_count)
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='faceid_bench_')
+    try:
+        results.update(bench_frames(frames, args.repeats, args.detect_scale))
+        for size in args.sizes:
+            results.update(bench_gallery(size, args.queries, args.batch, args.repeats, workdir))
+        results.update(bench_enrol(args.enrol, args.enrol_count, args.processes, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'opencv': cv2.__version__, 'machine': platform.machine(),
+                       'cpus': os.cpu_count(), 'frames': args.frames or 'generated', 'args': vars(args)},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    for key, value in results.items():
+        print(f"{key:>40} {value:>10.3f}")
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        rows, regressions = compare(results, baseline, args.tolerance)
+        print(f"{'metric':>40} {'baseline':>10} {'current':>10} {'change':>8}")
+        for key, old, new, change in rows:
+            flag = '  REGRESSION' if key in regressions else ''
+            print(f"{key:>40} {old:>10.3f} {new:>10.3f} {change:>+8.1%}{flag}")
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import time
+import itertools
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+from tracker import iou
+
+def dhash(crop, size=8):
+    # 64-bit difference hash: brightness gradients of an 9x8 thumbnail, stable under
+    # small shifts and lighting noise, different once the face turns or someone else steps in
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), 'big')
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+class CacheEntry:
+    def __init__(self, loc, phash, vec, name, match_percentage, encoded_at):
+        self.loc = loc
+        self.phash = phash
+        self.vec = vec
+        self.name = name
+        self.match_percentage = match_percentage
+        self.encoded_at = encoded_at
+
+class EmbeddingCache:
+    # LRU of encodings keyed by track: a face box that overlaps a cached track by
+    # min_iou and whose crop hash is within max_hash_distance bits reuses that track's
+    # encoding and match instead of running dlib again. Entries expire ttl seconds
+    # after they were encoded, so a static face is still re-checked now and then.
+    def __init__(self, max_size=256, ttl=2.0, min_iou=0.5, max_hash_distance=6, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.min_iou = min_iou
+        self.max_hash_distance = max_hash_distance
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.track_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _expire(self, now):
+        for track_id in [track_id for track_id, entry in self.entries.items() if now - entry.encoded_at > self.ttl]:
+            del self.entries[track_id]
+            self.evictions += 1
+
+    def lookup(self, image_test, locs_test):
+        # Returns (track_id, phash, entry or None) per box, None means it has to be encoded
+        now = self.clock()
+        lookups = []
+        with self.lock:
+            self._expire(now)
+            used = set()
+            for loc in locs_test:
+                top, right, bottom, left = loc
+                phash = dhash(image_test[max(0, top):bottom, max(0, left):right])
+                candidates = [(iou(entry.loc, loc), track_id) for track_id, entry in self.entries.items()
+                              if track_id not in used]
+                overlap, track_id = max(candidates, default=(0.0, None))
+                if track_id is None or overlap < self.min_iou:
+                    track_id = next(self.track_ids)
+                    entry = None
+                else:
+                    entry = self.entries[track_id]
+                    if hamming(entry.phash, phash) > self.max_hash_distance:
+                        entry = None
+                used.add(track_id)
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    entry.loc = loc
+                    self.entries.move_to_end(track_id)
+                lookups.append((track_id, phash, entry))
+        return lookups
+
+    def store(self, track_id, loc, phash, vec, name, match_percentage):
+        with self.lock:
+            self.entries[track_id] = CacheEntry(loc, phash, vec, name, match_percentage, self.clock())
+            self.entries.move_to_end(track_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.entries),
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
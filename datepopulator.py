@@ -1,7 +1,9 @@
 import gspread
+import numpy as np
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta
-from gsheets import retry_on_rate_limit
+from gspread.utils import rowcol_to_a1
+from gsheets import retry_on_rate_limit, parse_sheet_date
 
 def validate_date_range(date_range):
     try:
@@ -14,15 +16,38 @@ def validate_date_range(date_range):
     except ValueError:
         return None, None, "Invalid date format. Please use YYYY-MM-DD to YYYY-MM-DD."
 
+# Session weekdays as in datetime.weekday(), Monday is 0
+WEEKEND = (5, 6)
+
+def day_of_week(days):
+    # datetime64 days count from 1970-01-01, which was a Thursday
+    return (days.astype(np.int64) + 3) % 7
+
+def session_dates(start_date, end_date, weekdays=WEEKEND, holidays=()):
+    # One arange per session weekday stepping a week at a time instead of walking every day
+    start = np.datetime64(start_date, 'D')
+    stop = np.datetime64(end_date, 'D') + 1
+    firsts = start + (np.asarray(weekdays, dtype=np.int64) - day_of_week(start)) % 7
+    # The empty array keeps concatenate happy when no weekday is given
+    days = np.sort(np.concatenate([np.array([], dtype='datetime64[D]')] +
+                                  [np.arange(first, stop, 7) for first in firsts]))
+    if len(holidays):
+        days = days[~np.isin(days, np.array(list(holidays), dtype='datetime64[D]'))]
+    return days
+
+def format_sessions(days):
+    # "Sep 7, 2024" per session with a blank cell closing each Monday-to-Sunday week
+    weeks = (days.astype(np.int64) + 3) // 7
+    formatted = []
+    for i, day in enumerate(days.astype(object)):
+        formatted.append(f"{day.strftime('%b')} {day.day}, {day.year}")
+        if i + 1 == len(days) or weeks[i + 1] != weeks[i]:
+            formatted.append('')
+    return formatted
+
 def get_weekends_in_range(start_date, end_date):
-    current_date = start_date
-    weekends = []
-    while current_date <= end_date:
-        if current_date.weekday() == 5:  # Saturday
-            weekend = [current_date, current_date + timedelta(days=1)]
-            weekends.append(weekend)
-        current_date += timedelta(days=1)
-    return weekends
+    saturdays = session_dates(start_date, end_date, weekdays=(5,))
+    return [[saturday, saturday + timedelta(days=1)] for saturday in saturdays.astype('datetime64[us]').astype(object)]
 
 def format_weekends(weekends):
     formatted_weekends = []
@@ -32,7 +57,32 @@ def format_weekends(weekends):
         formatted_weekends.append('')  # Blank cell after each weekend
     return formatted_weekends
 
-def populate_dates(sheet, date_range):
+def parse_holidays(text):
+    # Comma or newline separated YYYY-MM-DD dates, a bad entry raises ValueError naming it
+    entries = [day.strip() for day in text.replace('\n', ',').split(',') if day.strip()]
+    holidays = []
+    for number, day in enumerate(entries, start=1):
+        try:
+            holidays.append(datetime.strptime(day, '%Y-%m-%d').date())
+        except ValueError:
+            raise ValueError(f"Holiday {number} ({day!r}) is not a valid date, please use YYYY-MM-DD.")
+    return holidays
+
+def missing_header_cells(header, days):
+    # Returns (first column, values) for the sessions the header lacks, or None
+    existing = np.array([day for day in map(parse_sheet_date, header) if day], dtype='datetime64[D]')
+    days = days[~np.isin(days, existing)]
+    if not len(days):
+        return None
+    values = format_sessions(days)
+    # Column A stays empty above the names, and an existing header needs a blank before the new week
+    if not header or header[-1] != '':
+        values.insert(0, '')
+    return len(header) + 1, values
+
+def populate_dates(sheet, date_range, header=None, weekdays=WEEKEND, holidays=()):
+    # `header` is the current first row, only the missing date columns are appended after it
+    # in one write, nothing is read back from the sheet
     while True:
         start_date, end_date, error = validate_date_range(date_range)
         if error:
@@ -41,14 +91,13 @@ def populate_dates(sheet, date_range):
             continue
         break
 
-    weekends = get_weekends_in_range(start_date, end_date)
-    formatted_weekends = format_weekends(weekends)
-    formatted_weekends.insert(0, '')  # Ensure the list starts with an empty cell
-
-    cell_list = sheet.range(1, 1, 1, len(formatted_weekends))
-    for cell, date in zip(cell_list, formatted_weekends):
-        cell.value = date
-    retry_on_rate_limit(sheet.update_cells, cell_list)
+    missing = missing_header_cells(header or [], session_dates(start_date, end_date, weekdays, holidays))
+    if missing is None:
+        return 0
+    first_col, values = missing
+    range_name = f"{rowcol_to_a1(1, first_col)}:{rowcol_to_a1(1, first_col + len(values) - 1)}"
+    retry_on_rate_limit(sheet.update, values=[values], range_name=range_name)
+    return sum(1 for value in values if value)
 
 # Setup Google Sheets connection
 def connect_to_google_sheets(credentials_file, sheet_name):
@@ -64,11 +113,8 @@ def main():
     sheet_name = 'gsheets test123'  # Update this with your sheet name
     sheet = connect_to_google_sheets(credentials_file, sheet_name)
 
-    # Check if the first row is already filled
+    # Dates already in the first row are kept, only missing sessions are added
     first_row = sheet.row_values(1)
-    if first_row:
-        print("The first row is already filled.")
-        return
 
     # Prompt user for date range
     while True:
@@ -78,21 +124,16 @@ def main():
             print(error)
             continue
         break
+    while True:
+        try:
+            holidays = parse_holidays(input("Holidays to skip (YYYY-MM-DD, comma separated, blank for none): "))
+        except ValueError as e:
+            print(e)
+            continue
+        break
 
-    # Get and format weekends
-    weekends = get_weekends_in_range(start_date, end_date)
-    formatted_weekends = format_weekends(weekends)
-
-    # Ensure the list starts with an empty cell for the first cell in the row
-    formatted_weekends.insert(0, '')
-
-    # Populate the first row with weekends
-    cell_list = sheet.range(1, 1, 1, len(formatted_weekends))
-    for cell, date in zip(cell_list, formatted_weekends):
-        cell.value = date
-    sheet.update_cells(cell_list)
-
-    print("The first row has been populated with the weekends in the specified date range.")
+    added = populate_dates(sheet, date_range, header=first_row, holidays=holidays)
+    print(f"Added {added} session dates to the first row.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
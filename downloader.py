@@ -0,0 +1,184 @@
+import os
+import json
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from store import safe_name, write_atomic
+
+# Kept next to the images, dotfiles are skipped by sync_database
+MANIFEST_FILENAME = '.downloads.json'
+DEFAULT_WORKERS = 8
+# Content types cv2.imread can decode, anything else is saved as .jpg and left to enrolment to reject
+IMAGE_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'image/bmp': '.bmp'}
+
+def make_session(workers=DEFAULT_WORKERS, retries=3):
+    # One keep-alive connection per worker, transient errors are retried by urllib3
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def guess_extension(response):
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    return IMAGE_EXTENSIONS.get(content_type, '.jpg')
+
+def url_name(url):
+    # Last path segment without its extension, the best guess at a name when none is given
+    return safe_name(os.path.splitext(os.path.basename(urlparse(url).path))[0]) or 'unnamed'
+
+class Downloader:
+    # Fetches images into `folder` on a bounded thread pool sharing one pooled session.
+    # The manifest remembers each URL's ETag/Last-Modified and content hash, so a re-run
+    # only sends conditional requests and the same avatar behind several URLs is saved once.
+    # Images are saved as <folder>/<person>/<hash prefix><ext>, so every photo of a person
+    # enrols as a template of that identity; the hash only keeps file names unique.
+    def __init__(self, folder='known_faces', workers=DEFAULT_WORKERS, timeout=30.0, session=None,
+                 on_saved=None, checkpoint_every=50):
+        self.folder = folder
+        self.timeout = timeout
+        self.session = session or make_session(workers)
+        self.on_saved = on_saved
+        self.checkpoint_every = checkpoint_every
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.submitted = set()
+        os.makedirs(folder, exist_ok=True)
+        self.manifest_path = os.path.join(folder, MANIFEST_FILENAME)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {'urls': {}, 'hashes': {}}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def save_manifest(self):
+        with self.lock:
+            data = json.dumps(self.manifest, indent=1, sort_keys=True).encode()
+        write_atomic(self.manifest_path, data)
+
+    def submit(self, url, name=None):
+        # Returns a future for the saved path, None when nothing new was written.
+        # A URL already submitted in this run is not fetched twice.
+        with self.lock:
+            if url in self.submitted:
+                return None
+            self.submitted.add(url)
+        return self.executor.submit(self._fetch, url, name)
+
+    def download_all(self, urls, names=None):
+        futures = [self.submit(url, name) for url, name in zip(urls, names or [None] * len(urls))]
+        paths = [future.result() for future in futures if future is not None]
+        return [path for path in paths if path]
+
+    def _fetch(self, url, name):
+        try:
+            path = self.fetch(url, name)
+        except Exception as e:
+            print(f"Could not download {url}: {e}")
+            with self.lock:
+                self.counts['failed'] += 1
+            return None
+        if path and self.on_saved:
+            self.on_saved(path)
+        return path
+
+    def fetch(self, url, name=None):
+        with self.lock:
+            known = self.manifest['urls'].get(url)
+        headers = {}
+        if known and os.path.exists(os.path.join(self.folder, known['filename'])):
+            if known.get('etag'):
+                headers['If-None-Match'] = known['etag']
+            if known.get('last_modified'):
+                headers['If-Modified-Since'] = known['last_modified']
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            with self.lock:
+                self.counts['not_modified'] += 1
+            return None
+        response.raise_for_status()
+
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        entry = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified'),
+                 'sha256': digest}
+        with self.lock:
+            existing = self.manifest['hashes'].get(digest)
+            if existing and os.path.exists(os.path.join(self.folder, existing)):
+                # Same bytes as an image we already have, only the URL is remembered
+                self.manifest['urls'][url] = dict(entry, filename=existing)
+                self.counts['duplicate'] += 1
+                return None
+            replaced = None
+            if known:
+                # The image behind this URL changed, the new file replaces the old one
+                if self.manifest['hashes'].get(known['sha256']) == known['filename']:
+                    del self.manifest['hashes'][known['sha256']]
+                if not any(other['filename'] == known['filename'] for other_url, other in self.manifest['urls'].items()
+                           if other_url != url):
+                    replaced = known['filename']
+            person = safe_name(name or '') or (known and os.path.dirname(known['filename'])) or url_name(url)
+            filename = os.path.join(person, digest[:16] + guess_extension(response))
+            self.manifest['hashes'][digest] = filename
+        path = os.path.join(self.folder, filename)
+        write_atomic(path, content)
+        if replaced and replaced != filename:
+            try:
+                os.remove(os.path.join(self.folder, replaced))
+            except FileNotFoundError:
+                pass
+
+        with self.lock:
+            self.manifest['urls'][url] = dict(entry, filename=filename)
+            self.counts['downloaded'] += 1
+            checkpoint = self.counts['downloaded'] % self.checkpoint_every == 0
+        # Checkpoint so an interrupted run resumes with conditional requests
+        if checkpoint:
+            self.save_manifest()
+        return path
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.save_manifest()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def report(self):
+        print(f"Downloads: {self.counts['downloaded']} saved, {self.counts['not_modified']} not modified, "
+              f"{self.counts['duplicate']} duplicates, {self.counts['failed']} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description="Download images into the known faces folder")
+    parser.add_argument('urls', help="file with one image URL per line, optionally followed by the person's name")
+    parser.add_argument('--folder', default='known_faces')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    with open(args.urls) as f:
+        # One URL per line, optionally followed by the person's name
+        lines = [line.strip().split(None, 1) for line in f if line.strip()]
+    urls = [line[0] for line in lines]
+    names = [line[1] if len(line) > 1 else None for line in lines]
+    with Downloader(args.folder, workers=args.workers) as downloader:
+        downloader.download_all(urls, names)
+    downloader.report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import os
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+import numpy as np
+import dlib
+from face_recognition import api as fr_api
+from faceid import load_image, detect_locations, encode_locations
+
+# Same chip geometry face_recognition.face_encodings uses internally
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+
+def face_chips(image_test, locs_test):
+    # Landmarks and alignment per frame, the cheap part, the network runs later on many chips at once
+    if len(locs_test) == 0:
+        return []
+    landmarks = fr_api._raw_face_landmarks(image_test, locs_test, model='small')
+    return [dlib.get_face_chip(image_test, shape, size=CHIP_SIZE, padding=CHIP_PADDING) for shape in landmarks]
+
+def locate_chips(image_test, detect_scale=1.0):
+    # Pool-worker counterpart of faceid.locate_faces that stops before the network
+    locs_test = detect_locations(image_test, detect_scale)
+    return locs_test, face_chips(image_test, locs_test)
+
+def encode_chips(chips):
+    # One forward pass of dlib's ResNet over every chip
+    if not chips:
+        return []
+    return [np.array(vec) for vec in fr_api.face_encoder.compute_face_descriptor(list(chips))]
+
+class EncodingService:
+    # Collects aligned chips from any number of frames or sources into micro-batches:
+    # a batch is encoded once it holds max_batch chips or max_wait seconds after its
+    # first request, and every caller's future gets back the encodings of its own chips.
+    def __init__(self, max_batch=32, max_wait=0.01, encode=encode_chips):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.encode = encode
+        self.requests = queue.Queue()
+        self.thread = None
+        self.batches = 0
+        self.encoded = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        # Requests already submitted are still encoded
+        self.requests.put(None)
+        self.thread.join()
+
+    def submit(self, chips):
+        future = Future()
+        if len(chips) == 0:
+            future.set_result([])
+        else:
+            self.requests.put((list(chips), future))
+        return future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            request = self.requests.get()
+            if request is None:
+                break
+            batch = [request]
+            size = len(request[0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch):
+        chips = [chip for request_chips, _ in batch for chip in request_chips]
+        try:
+            vecs = self.encode(chips)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.encoded += len(chips)
+        start = 0
+        for request_chips, future in batch:
+            future.set_result(vecs[start:start + len(request_chips)])
+            start += len(request_chips)
+
+    def stats(self):
+        return {'batches': self.batches, 'encoded': self.encoded,
+                'mean_batch': self.encoded / self.batches if self.batches else 0.0}
+
+def benchmark(frames, batch_sizes, repeats=3):
+    # Per-frame face_encodings against chips encoded in batches of each size, faces/s on the CPU
+    locs = [detect_locations(frame) for frame in frames]
+    faces = sum(len(l) for l in locs)
+    if not faces:
+        print("No faces found in the frames")
+        return
+
+    def per_frame():
+        return [vec for frame, l in zip(frames, locs) for vec in encode_locations(frame, l)]
+
+    def best_of(func):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    elapsed, reference = best_of(per_frame)
+    print(f"{faces} faces in {len(frames)} frames")
+    print(f"{'mode':>12} {'faces/s':>9} {'ms/face':>8} {'max diff':>9}")
+    print(f"{'per-frame':>12} {faces / elapsed:>9.1f} {elapsed / faces * 1000:>8.2f} {0.0:>9.2e}")
+
+    for batch_size in batch_sizes:
+        def batched():
+            chips = [chip for frame, l in zip(frames, locs) for chip in face_chips(frame, l)]
+            return [vec for i in range(0, len(chips), batch_size) for vec in encode_chips(chips[i:i + batch_size])]
+        elapsed, vecs = best_of(batched)
+        diff = float(np.abs(np.array(vecs) - np.array(reference)).max())
+        print(f"{'batch ' + str(batch_size):>12} {faces / elapsed:>9.1f} {elapsed / faces * 1000:>8.2f} {diff:>9.2e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of batched against per-frame face encoding")
+    parser.add_argument('frames', nargs='?', default='known_faces', help="folder of frames or face images")
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    names = sorted(name for name in os.listdir(args.frames) if not name.startswith('.'))[:args.limit]
+    frames = [load_image(os.path.join(args.frames, name)) for name in names]
+    benchmark(frames, args.batch_sizes, args.repeats)
+
+if __name__ == "__main__":
+    main()
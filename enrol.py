@@ -0,0 +1,120 @@
+import os
+import time
+import threading
+import multiprocessing
+import numpy as np
+from faceid import encode_image_file, file_digest, load_database, build_gallery
+from store import identity_name
+from gallery import ENCODING_SIZE
+
+# Closer than this to an enrolled face counts as the same photo again, well under the 0.6 match threshold
+DUPLICATE_DISTANCE = 0.3
+
+class StreamingEnroller:
+    # Enrols images while they are still arriving: each path handed to submit() goes
+    # straight to a pool worker for detection and encoding, and the result is added to
+    # the store as soon as it completes. Images without a face, or whose face is a
+    # near-duplicate of one already enrolled, are rejected instead of added. Only the
+    # faceless ones are remembered in the store: a duplicate stops being one when its
+    # match is deleted, so a later sync_database must still be free to enrol it.
+    def __init__(self, folder='known_faces', processes=None, duplicate_distance=DUPLICATE_DISTANCE, max_pending=None,
+                 checkpoint_every=50):
+        # Sources are recorded relative to folder, as sync_database does, so it sees them as already enrolled
+        self.folder = folder
+        self.processes = processes or os.cpu_count() or 1
+        self.duplicate_distance = duplicate_distance
+        self.checkpoint_every = checkpoint_every
+        self.store = load_database()
+        self.gallery = build_gallery(self.store)
+        self.rejected = self.store.meta.setdefault('rejected', {})
+        self.added = []
+        self.counts = {'enrolled': 0, 'no_face': 0, 'duplicate': 0, 'failed': 0}
+        self.lock = threading.Lock()
+        # Bounds images queued for the pool, submit() blocks the producer when workers fall behind
+        self.slots = threading.Semaphore(max_pending or self.processes * 4)
+        self.pending = 0
+        self.idle = threading.Condition(self.lock)
+        self.pool = multiprocessing.Pool(self.processes)
+        self.started_at = time.perf_counter()
+
+    def submit(self, path):
+        self.slots.acquire()
+        with self.lock:
+            self.pending += 1
+        self.pool.apply_async(encode_image_file, (path,), callback=self._encoded,
+                              error_callback=lambda error, p=path: self._failed(p, error))
+
+    def _failed(self, path, error):
+        self._log_failure(path, error)
+        self._done()
+
+    def _log_failure(self, path, error):
+        print(f"Could not enrol {os.path.basename(path)}: {error}")
+        with self.lock:
+            self.counts['failed'] += 1
+
+    def _done(self):
+        self.slots.release()
+        with self.lock:
+            self.pending -= 1
+            self.idle.notify_all()
+
+    def nearest_distance(self, vec):
+        # Against the gallery as it was at start plus everything enrolled since
+        ids, dists = self.gallery.search(vec, k=1)
+        nearest = float(dists[0][0])
+        if self.added:
+            added = np.array(self.added, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            nearest = min(nearest, float(np.sqrt(((added - vec) ** 2).sum(axis=1)).min()))
+        return nearest
+
+    def _encoded(self, result):
+        # Runs on the pool's result thread, one result at a time. An exception escaping
+        # here would kill that thread and leave join() waiting forever, so a file that
+        # vanished or cannot be stored is logged and skipped.
+        path, face, elapsed = result
+        try:
+            self._add(path, face, elapsed)
+        except Exception as e:
+            self._log_failure(path, e)
+        finally:
+            self._done()
+
+    def _add(self, path, face, elapsed):
+        filename = os.path.relpath(path, self.folder)
+        stat = os.stat(path)
+        signature = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_digest(path)}
+        with self.lock:
+            if face is None:
+                self.rejected[filename] = dict(signature, reason='no_face')
+                self.counts['no_face'] += 1
+            elif self.nearest_distance(face.feature_vector) < self.duplicate_distance:
+                print(f"{filename}: near-duplicate of an enrolled face, skipped")
+                self.counts['duplicate'] += 1
+            else:
+                self.store.add(identity_name(filename), face.feature_vector, face.cropped_face,
+                               bounding_box=[int(v) for v in face.bounding_box], source=filename, **signature)
+                self.added.append(np.asarray(face.feature_vector, dtype=np.float32))
+                self.counts['enrolled'] += 1
+                print(f"{filename}: enrolled in {elapsed * 1000:.0f} ms")
+                # Checkpoint so an interrupted scrape keeps what it already enrolled
+                if self.counts['enrolled'] % self.checkpoint_every == 0:
+                    self.store.save()
+
+    def join(self):
+        with self.lock:
+            while self.pending:
+                self.idle.wait()
+
+    def close(self):
+        # Waits for the images already submitted, then saves the store once
+        self.join()
+        self.pool.close()
+        self.pool.join()
+        with self.lock:
+            self.store.save()
+        elapsed = time.perf_counter() - self.started_at
+        print(f"Enrolled {self.counts['enrolled']} faces in {elapsed:.1f} s, rejected {self.counts['no_face']} "
+              f"without a face and {self.counts['duplicate']} near-duplicates, {self.counts['failed']} failed, "
+              f"{len(self.store)} total")
+        return self.store
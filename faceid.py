@@ -1,11 +1,26 @@
 import cv2
 import face_recognition
-import numpy as np
 from tqdm import tqdm
-import pickle
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import multiprocessing
+from datetime import date
+from collections import OrderedDict, deque
+from gallery import IdentityGallery, as_gallery
+from index import make_index, save_index, load_index
+from store import FaceStore, STORE_DIRNAME, migrate_pickle, identity_name, list_images
 
-consistent_faces = {}
+UNKNOWN_NAME = 'Unknown Face Detected'
 DATABASE_FILENAME = 'faces_database.pkl'
+INDEX_FILENAME = os.path.join(STORE_DIRNAME, 'index.npz')
+IVF_MIN_SIZE = 10000
+
+# Per-face and per-frame messages, at debug level so they cost nothing on the hot path unless asked for
+log = logging.getLogger(__name__)
 
 class Face:
     def __init__(self, bounding_box, cropped_face, name, feature_vector):
@@ -20,17 +35,55 @@ def load_image(path):
     return image
 
 def save_database(faces):
-    with open(DATABASE_FILENAME, 'wb') as f:
-        pickle.dump(faces, f)
+    store = FaceStore.open(STORE_DIRNAME)
+    store.clear()
+    for face in faces:
+        store.add(face.name, face.feature_vector, face.cropped_face,
+                  bounding_box=[int(v) for v in face.bounding_box])
+    store.save()
 
 def load_database():
-    try:
-        with open(DATABASE_FILENAME, 'rb') as f:
-            faces = pickle.load(f)
-        return faces
-    except FileNotFoundError:
-        return []
-    
+    store = FaceStore.open(STORE_DIRNAME)
+    if not store.exists() and os.path.exists(DATABASE_FILENAME):
+        store = migrate_pickle(DATABASE_FILENAME, STORE_DIRNAME)
+    return store
+
+def build_gallery(faces, index_kind=None, n_probe=16, rerank=5):
+    # Photos sharing a name are templates of one identity, the index covers one centroid per identity.
+    # A saved store's grouping is written next to it once and mapped by every later caller
+    if isinstance(faces, FaceStore):
+        layout_path = os.path.join(faces.path, f'gallery-{faces.version}')
+        saved = faces.exists() and not faces.modified
+        gallery = IdentityGallery.load(layout_path, rerank=rerank) if saved else None
+        if gallery is None:
+            gallery = IdentityGallery(faces.names, faces.embeddings, rerank=rerank)
+            if saved:
+                gallery.save(layout_path)
+                remove_old_layouts(faces.path, layout_path)
+                # Map the saved copy too, so this process shares the page cache with later ones
+                gallery = IdentityGallery.load(layout_path, rerank=rerank) or gallery
+    else:
+        gallery = IdentityGallery.from_faces(faces)
+        gallery.rerank = rerank
+    if index_kind is None:
+        index_kind = 'ivf' if len(gallery) >= IVF_MIN_SIZE else 'brute'
+    if index_kind == 'brute' or len(gallery) == 0:
+        return gallery
+
+    index = load_index(INDEX_FILENAME, gallery.encodings, n_probe=n_probe)
+    if index is None or index.kind != index_kind:
+        index = make_index(index_kind, n_probe=n_probe).build(gallery.encodings)
+        save_index(index, INDEX_FILENAME, gallery.encodings)
+    gallery.index = index
+    return gallery
+
+def remove_old_layouts(store_path, layout_path):
+    # Processes still mapping an old layout keep their open files
+    for name in os.listdir(store_path):
+        path = os.path.join(store_path, name)
+        if name.startswith('gallery-') and path != layout_path and not name.endswith('.tmp'):
+            shutil.rmtree(path, ignore_errors=True)
+
 def draw_bounding_box(image_test, loc_test):
     top, right, bottom, left = loc_test
     line_color = (0, 255, 0)
@@ -51,60 +104,328 @@ def draw_name(image_test, loc_test, pred_name, conf):
     cv2.putText(image_test, str(pred_name) + " " + str(round(conf, 2)) + "%", (left, top), font, font_scale, font_color, line_thickness)
     return image_test
 
-def create_database(filenames, images):
+def create_face(filename, image):
+    try:
+        loc = face_recognition.face_locations(image, model='hog')[0]
+        vec = face_recognition.face_encodings(image, [loc], num_jitters=20)[0]
+    except Exception as e:
+        print(f"No Face Found in {filename}")
+        return None
+
+    top, right, bottom, left = loc
+    cropped_face = image[top:bottom, left:right]
+    return Face(bounding_box=loc, cropped_face=cropped_face, name=identity_name(filename), feature_vector=vec)
+
+def encode_image_file(path):
+    # Runs in a pool worker: decoding happens here so the parent never holds every image
+    start = time.perf_counter()
+    filename = os.path.basename(path)
+    try:
+        face = create_face(filename, load_image(path))
+    except Exception as e:
+        print(f"Could not read {filename}: {e}")
+        face = None
+    return path, face, time.perf_counter() - start
+
+def encode_images(paths, processes=None):
+    # Yields (path, face or None, seconds) in completion order
+    processes = min(processes or os.cpu_count() or 1, len(paths))
+    start = time.perf_counter()
+    if processes <= 1:
+        results = map(encode_image_file, paths)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(encode_image_file, paths)
+
+    try:
+        for path, face, elapsed in tqdm(results, total=len(paths)):
+            tqdm.write(f"{os.path.basename(path)}: {elapsed * 1000:.0f} ms")
+            yield path, face, elapsed
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    total = time.perf_counter() - start
+    if paths:
+        print(f"Encoded {len(paths)} images in {total:.1f} s ({len(paths) / total:.2f} images/s, {processes} processes)")
+
+def create_database(paths, processes=None):
     faces = []
-    for filename, image in tqdm(zip(filenames, images), total=len(filenames)):
-        try:
-            loc = face_recognition.face_locations(image, model='hog')[0]
-            vec = face_recognition.face_encodings(image, [loc], num_jitters=20)[0]
-        except Exception as e:
-            print(f"No Face Found in {filename}")
+    for path, face, elapsed in encode_images(paths, processes):
+        if face is not None:
+            faces.append(face)
+
+    return faces
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def sync_database(folder_path='known_faces', processes=None, checkpoint_every=100):
+    # Brings the store in line with folder_path: only added or modified images are
+    # encoded, entries for deleted images are dropped, everything else is untouched.
+    # A file whose size and mtime match its entry is not even read.
+    store = load_database()
+    by_source = {}
+    stale_ids = []
+    for entry in store.entries:
+        # Entries migrated from the pickle have no source yet, they are adopted by name
+        key = entry.get('source', entry['name'])
+        if key in by_source:
+            stale_ids.append(entry['id'])
+        else:
+            by_source[key] = entry
+    rejected = store.meta.setdefault('rejected', {})
+
+    filenames = list_images(folder_path)
+    present = set(filenames)
+    to_encode = []
+    changed = False
+    for filename in filenames:
+        path = os.path.join(folder_path, filename)
+        stat = os.stat(path)
+        signature = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        entry = by_source.pop(filename, None) or by_source.pop(filename.split('.')[0], None)
+
+        if entry is not None and 'sha1' not in entry:
+            entry.update(signature, source=filename, sha1=file_digest(path))
+            changed = True
             continue
 
-        top, right, bottom, left = loc
-        cropped_face = image[top:bottom, left:right]
-        face = Face(bounding_box=loc, cropped_face=cropped_face, name=filename.split('.')[0], feature_vector=vec)
-        faces.append(face)
+        known = entry if entry is not None else rejected.get(filename)
+        if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+            continue
 
-    return faces
+        digest = file_digest(path)
+        if known is not None and known['sha1'] == digest:
+            known.update(signature)
+            changed = True
+            continue
 
-def detect_faces(image_test, faces, detected_faces, threshold=0.6, unknown_threshold=0.55, min_frames = 20):
-    locs_test = face_recognition.face_locations(image_test, model='hog')
-    vecs_test = face_recognition.face_encodings(image_test, locs_test, num_jitters=1)
+        if entry is not None:
+            stale_ids.append(entry['id'])
+        to_encode.append((filename, dict(signature, sha1=digest)))
 
-    if len(locs_test) == 0:  # Check if no faces are detected
-        print("No Faces Detected")
-        return image_test
+    stale_ids.extend(entry['id'] for entry in by_source.values())
+    for filename in list(rejected):
+        if filename not in present:
+            del rejected[filename]
+            changed = True
+
+    if stale_ids:
+        store.remove(stale_ids)
+        changed = True
+
+    signatures = dict(to_encode)
+    paths = [os.path.join(folder_path, filename) for filename in signatures]
+    for done, (path, face, elapsed) in enumerate(encode_images(paths, processes), start=1):
+        filename = os.path.relpath(path, folder_path)
+        rejected.pop(filename, None)
+        if face is None:
+            rejected[filename] = signatures[filename]
+        else:
+            store.add(identity_name(filename), face.feature_vector, face.cropped_face,
+                      bounding_box=[int(v) for v in face.bounding_box], source=filename, **signatures[filename])
+        changed = True
+        # Checkpoint so an interrupted enrolment keeps what it already encoded
+        if done % checkpoint_every == 0:
+            store.save()
+
+    if changed:
+        store.save()
+        print(f"Face database synced: {len(to_encode)} encoded, {len(stale_ids)} removed, {len(store)} total")
+        store = FaceStore.open(STORE_DIRNAME)
+    return store
+
+def scale_location(loc, factor, height, width):
+    top, right, bottom, left = loc
+    return (max(int(round(top * factor)), 0), min(int(round(right * factor)), width),
+            min(int(round(bottom * factor)), height), max(int(round(left * factor)), 0))
+
+def detect_locations(image_test, detect_scale=1.0):
+    # HOG cost grows with pixel count, so detect on a downscaled copy and map the
+    # boxes back to full-resolution coordinates
+    if detect_scale == 1.0:
+        return face_recognition.face_locations(image_test, model='hog')
+    small = cv2.resize(image_test, (0, 0), fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+    height, width = image_test.shape[:2]
+    return [scale_location(loc, 1 / detect_scale, height, width)
+            for loc in face_recognition.face_locations(small, model='hog')]
 
-    for loc_test, vec_test in zip(locs_test, vecs_test):
-        distances = [face_recognition.face_distance([vec_test], face.feature_vector) for face in faces]
-        min_distance = np.min(distances)
+def encode_locations(image_test, locs_test):
+    return face_recognition.face_encodings(image_test, locs_test, num_jitters=1)
+
+def locate_faces(image_test, detect_scale=1.0):
+    locs_test = detect_locations(image_test, detect_scale)
+    if len(locs_test) == 0:
+        return [], []
+    return locs_test, encode_locations(image_test, locs_test)
+
+def match_faces(locs_test, vecs_test, faces, threshold=0.6, unknown_threshold=0.55):
+    # Returns (location, predicted name, match percentage) per face
+    if len(locs_test) == 0:
+        return []
+
+    gallery = as_gallery(faces)
+    pred_names, min_distances = gallery.match(vecs_test, k=1)
+    return classify_matches(locs_test, pred_names, min_distances, threshold, unknown_threshold)
+
+def classify_matches(locs_test, pred_names, min_distances, threshold=0.6, unknown_threshold=0.55):
+    # Applies the unknown/known thresholds to top-1 gallery matches
+    results = []
+    for loc_test, names, distances in zip(locs_test, pred_names, min_distances):
+        min_distance = distances[0]
         match_percentage = (1 - min_distance) * 100
 
         if match_percentage / 100 < threshold:
-            print("Unknown Face Detected")
-            pred_name = 'Unknown Face Detected'
+            log.debug("Unknown Face Detected")
+            pred_name = UNKNOWN_NAME
 
         else:
             if match_percentage / 100 < unknown_threshold:
-                print("Unknown Face Detected")
-                pred_name = 'Unknown Face Detected'
+                log.debug("Unknown Face Detected")
+                pred_name = UNKNOWN_NAME
             else:
-                pred_index = np.argmin(distances)
-                pred_name = faces[pred_index].name
-                confidence = match_percentage / 100
-                print(f"Detected person: {pred_name} (Confidence: {match_percentage:.2f}%)")
+                pred_name = names[0]
+                log.debug("Detected person: %s (Confidence: %.2f%%)", pred_name, match_percentage)
+
+        results.append((loc_test, pred_name, match_percentage))
 
-            # Update local storage
-            if pred_name not in detected_faces:
-                detected_faces[pred_name] = 0
-            detected_faces[pred_name] += 1
+    return results
 
+def recognize_faces(image_test, faces, threshold=0.6, unknown_threshold=0.55, detect_scale=1.0, cache=None,
+                    detect=detect_locations, encode=encode_locations, encoded=None):
+    # Results answered from the cache repeat an earlier match, they are not new evidence.
+    # The ones actually encoded on this call are appended to the encoded list when one
+    # is given, that is what attendance votes should count.
+    locs_test = detect(image_test, detect_scale)
+    if len(locs_test) == 0:
+        return []
+    if cache is None:
+        results = match_faces(locs_test, encode(image_test, locs_test), faces, threshold, unknown_threshold)
+        if encoded is not None:
+            encoded.extend(results)
+        return results
+
+    # With an EmbeddingCache only faces whose crop changed since their last encoding go through dlib
+    lookups = cache.lookup(image_test, locs_test)
+    misses = [i for i, (track_id, phash, entry) in enumerate(lookups) if entry is None]
+    results = [(loc, entry.name, entry.match_percentage) if entry is not None else None
+               for loc, (track_id, phash, entry) in zip(locs_test, lookups)]
+    if misses:
+        miss_locs = [locs_test[i] for i in misses]
+        vecs_test = encode(image_test, miss_locs)
+        for i, vec, result in zip(misses, vecs_test, match_faces(miss_locs, vecs_test, faces, threshold, unknown_threshold)):
+            track_id, phash, entry = lookups[i]
+            cache.store(track_id, locs_test[i], phash, vec, result[1], result[2])
+            results[i] = result
+            if encoded is not None:
+                encoded.append(result)
+    return results
+
+class VoteAccumulator:
+    # Streaming attendance votes. Someone is confirmed once min_frames of their matches
+    # above the threshold fall within `window` seconds, so 20 sightings spread over an
+    # hour never count like 20 in a row, whatever the frame rate. Only the last
+    # min_frames vote times are kept per person, which makes each update O(1). Each
+    # person also has a confidence-weighted score that halves every half_life seconds,
+    # the live ranking scores() reports. Confirmation fires once per person, and people
+    # unseen for idle_timeout seconds are dropped, so state stays bounded by who is
+    # currently in view plus the confirmed list. The confirmed list starts over when
+    # today() changes, so a process running past midnight confirms everyone again for
+    # the new day; pass today=None to keep one list for the whole run.
+    def __init__(self, threshold=0.6, min_frames=20, window=60.0, half_life=5.0, idle_timeout=120.0,
+                 on_confirm=None, clock=time.monotonic, today=date.today):
+        self.threshold = threshold
+        self.min_frames = min_frames
+        self.window = window
+        self.half_life = half_life
+        self.idle_timeout = idle_timeout
+        self.on_confirm = on_confirm
+        self.clock = clock
+        # name -> [score, last seen, times of the last min_frames votes, votes], least recently seen first
+        self.active = OrderedDict()
+        # name -> {'at': confirmation time, 'votes': votes so far}, for self.day
+        self.confirmed = {}
+        self.today = today
+        self.day = today() if today is not None else None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.active)
+
+    def update(self, results, now=None):
+        # Returns the names confirmed by this frame
+        now = self.clock() if now is None else now
+        newly_confirmed = []
+        with self.lock:
+            self._roll_day()
+            for loc_test, pred_name, match_percentage in results:
+                confidence = float(match_percentage) / 100
+                if confidence < self.threshold or pred_name == UNKNOWN_NAME:
+                    continue
+                state = self.active.get(pred_name)
+                # Offline inputs can step back in time between files, never decay by a negative gap
+                gap = max(0.0, now - state[1]) if state is not None else None
+                if state is None or gap > self.idle_timeout:
+                    state = self.active[pred_name] = [0.0, now, deque(maxlen=self.min_frames), 0]
+                    gap = 0.0
+                self.active.move_to_end(pred_name)
+                state[0] = state[0] * 0.5 ** (gap / self.half_life) + confidence
+                state[1] = now
+                state[2].append(now)
+                state[3] += 1
+                if pred_name in self.confirmed:
+                    self.confirmed[pred_name]['votes'] += 1
+                elif len(state[2]) == self.min_frames and now - state[2][0] <= self.window:
+                    self.confirmed[pred_name] = {'at': now, 'votes': state[3]}
+                    newly_confirmed.append(pred_name)
+            self._evict(now)
+        if self.on_confirm is not None:
+            for name in newly_confirmed:
+                self.on_confirm(name)
+        return newly_confirmed
+
+    def _roll_day(self):
+        if self.today is not None:
+            day = self.today()
+            if day != self.day:
+                self.day = day
+                self.confirmed.clear()
+
+    def _evict(self, now):
+        while self.active:
+            name, (score, last_seen, times, votes) = next(iter(self.active.items()))
+            if now - last_seen <= self.idle_timeout:
+                break
+            del self.active[name]
+
+    def scores(self, now=None):
+        now = self.clock() if now is None else now
+        with self.lock:
+            return {name: score * 0.5 ** (max(0.0, now - last_seen) / self.half_life)
+                    for name, (score, last_seen, times, votes) in self.active.items()}
+
+    def attendance(self):
+        with self.lock:
+            self._roll_day()
+            return sorted(self.confirmed)
+
+def draw_results(image_test, results):
+    for loc_test, pred_name, match_percentage in results:
         image_test = draw_bounding_box(image_test, loc_test)
         image_test = draw_name(image_test, loc_test, pred_name, match_percentage)
+    return image_test
+
+def detect_faces(image_test, faces, votes, threshold=0.6, unknown_threshold=0.55, detect_scale=1.0, cache=None):
+    encoded = []
+    results = recognize_faces(image_test, faces, threshold, unknown_threshold, detect_scale, cache, encoded=encoded)
 
-    for name, count in detected_faces.items():
-        if count >= min_frames:
-            consistent_faces[name] = count
+    if len(results) == 0:  # Check if no faces are detected
+        log.debug("No Faces Detected")
+        return image_test
 
-    return image_test
\ No newline at end of file
+    votes.update(encoded)
+    return draw_results(image_test, results)
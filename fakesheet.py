@@ -0,0 +1,108 @@
+from collections import Counter
+import gspread
+from gspread.cell import Cell
+from gspread.utils import a1_to_rowcol
+
+class FakeResponse:
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.text = message
+
+    def json(self):
+        return {'error': {'code': self.status_code, 'message': self.text, 'status': 'RESOURCE_EXHAUSTED'}}
+
+class FakeWorksheet:
+    # In-memory stand-in for gspread.Worksheet that records every API call, so
+    # sheet code can be exercised offline and its request count asserted
+    def __init__(self, rows=None):
+        self.grid = [list(row) for row in rows or []]
+        self.calls = Counter()
+        self.failures = []
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def fail_next(self, count=1, status_code=429):
+        # The next `count` calls raise APIError with this status, like a quota hit
+        self.failures.extend([status_code] * count)
+
+    def _call(self, name):
+        self.calls[name] += 1
+        if self.failures:
+            raise gspread.exceptions.APIError(FakeResponse(self.failures.pop(0), "Quota exceeded"))
+
+    def _get(self, row, col):
+        if row <= len(self.grid) and col <= len(self.grid[row - 1]):
+            return self.grid[row - 1][col - 1]
+        return ''
+
+    def _set(self, row, col, value):
+        while len(self.grid) < row:
+            self.grid.append([])
+        line = self.grid[row - 1]
+        while len(line) < col:
+            line.append('')
+        line[col - 1] = '' if value is None else str(value)
+
+    def _trim(self, values):
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def get_all_values(self):
+        self._call('get_all_values')
+        width = max((len(self._trim(list(row))) for row in self.grid), default=0)
+        rows = [[self._get(r, c) for c in range(1, width + 1)] for r in range(1, len(self.grid) + 1)]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+    def row_values(self, row):
+        self._call('row_values')
+        return self._trim(list(self.grid[row - 1]) if row <= len(self.grid) else [])
+
+    def col_values(self, col):
+        self._call('col_values')
+        return self._trim([self._get(r, col) for r in range(1, len(self.grid) + 1)])
+
+    def cell(self, row, col):
+        self._call('cell')
+        return Cell(row, col, self._get(row, col) or None)
+
+    def find(self, query):
+        self._call('find')
+        for r, line in enumerate(self.grid, start=1):
+            for c, value in enumerate(line, start=1):
+                if value == query:
+                    return Cell(r, c, value)
+        return None
+
+    def range(self, first_row, first_col, last_row, last_col):
+        self._call('range')
+        return [Cell(r, c, self._get(r, c)) for r in range(first_row, last_row + 1)
+                for c in range(first_col, last_col + 1)]
+
+    def update_cell(self, row, col, value):
+        self._call('update_cell')
+        self._set(row, col, value)
+
+    def update_cells(self, cell_list):
+        self._call('update_cells')
+        for cell in cell_list:
+            self._set(cell.row, cell.col, cell.value)
+
+    def _write_range(self, range_name, values):
+        first_row, first_col = a1_to_rowcol(range_name.split(':')[0])
+        for r, line in enumerate(values):
+            for c, value in enumerate(line):
+                self._set(first_row + r, first_col + c, value)
+
+    def update(self, values=None, range_name=None):
+        self._call('update')
+        self._write_range(range_name, values)
+
+    def batch_update(self, data):
+        self._call('batch_update')
+        for item in data:
+            self._write_range(item['range'], item['values'])
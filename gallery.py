@@ -0,0 +1,163 @@
+import os
+import json
+import shutil
+import numpy as np
+from index import BruteForceIndex, squared_distances
+
+ENCODING_SIZE = 128
+
+class Gallery:
+    def __init__(self, names, encodings, index=None):
+        self.names = list(names)
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        # Contiguous float32 matrix so every query is a single BLAS call
+        self.encodings = np.ascontiguousarray(encodings)
+        self.index = index if index is not None else BruteForceIndex().build(self.encodings)
+
+    @classmethod
+    def from_faces(cls, faces, index=None):
+        names = [face.name for face in faces]
+        encodings = [face.feature_vector for face in faces]
+        return cls(names, np.array(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE), index=index)
+
+    def __len__(self):
+        return len(self.names)
+
+    def distances(self, vecs):
+        # Euclidean distance, same metric as face_recognition.face_distance, for every (query, entry) pair
+        queries = np.asarray(vecs, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        return np.sqrt(squared_distances(queries, self.encodings, self.index.sq_norms))
+
+    def search(self, vecs, k=1):
+        queries = np.asarray(vecs, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if len(self) == 0 or len(queries) == 0:
+            return (np.full((len(queries), k), -1, dtype=np.int64),
+                    np.full((len(queries), k), np.inf, dtype=np.float32))
+        return self.index.search(queries, k)
+
+    def match(self, vecs, k=1):
+        ids, dists = self.search(vecs, k)
+        names = [[self.names[i] if i >= 0 else None for i in row] for row in ids]
+        return names, dists
+
+def as_gallery(faces):
+    if isinstance(faces, Gallery):
+        return faces
+    return Gallery.from_faces(faces)
+
+# Template pruning, in the same Euclidean units as the match distance
+MAX_TEMPLATES = 10
+REDUNDANT_DISTANCE = 0.15
+OUTLIER_DISTANCE = 0.6
+
+def prune_templates(templates, max_templates=MAX_TEMPLATES, redundant_distance=REDUNDANT_DISTANCE,
+                    outlier_distance=OUTLIER_DISTANCE):
+    # Keeps a compact, spread-out subset of one person's templates: starting from the
+    # medoid, greedily add the template farthest from those kept until the farthest is
+    # within redundant_distance or max_templates are kept. With three or more photos,
+    # templates beyond outlier_distance from the medoid (wrong person, bad crop) are dropped.
+    templates = np.asarray(templates, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    if len(templates) <= 1:
+        return templates
+    sq_norms = np.einsum('ij,ij->i', templates, templates)
+    dists = np.sqrt(squared_distances(templates, templates, sq_norms))
+    medoid = int(np.argmin(dists.sum(axis=1)))
+    candidates = np.flatnonzero(dists[medoid] <= outlier_distance) if len(templates) >= 3 else np.arange(len(templates))
+
+    kept = [medoid]
+    nearest = dists[medoid].copy()
+    while len(kept) < max_templates:
+        farthest = candidates[np.argmax(nearest[candidates])]
+        if nearest[farthest] <= redundant_distance:
+            break
+        kept.append(int(farthest))
+        nearest = np.minimum(nearest, dists[farthest])
+    return templates[sorted(kept)]
+
+class IdentityGallery(Gallery):
+    # Several templates per person. names/encodings hold one centroid per person and
+    # the index is built over those, so the first pass scales with people; the
+    # `rerank` nearest people are then scored against all their templates and ranked
+    # by the nearest one. ids returned by search index the people, not the photos.
+    def __init__(self, names, encodings, index=None, rerank=5, prune=True):
+        templates = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        rows = {}
+        for row, name in enumerate(names):
+            rows.setdefault(name, []).append(row)
+
+        identities = sorted(rows)
+        groups = []
+        for name in identities:
+            group = templates[rows[name]]
+            groups.append(prune_templates(group) if prune else group)
+        centroids = np.array([group.mean(axis=0) for group in groups], dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        # CSR layout: templates[offsets[i]:offsets[i + 1]] belong to identity i
+        offsets = np.concatenate([[0], np.cumsum([len(group) for group in groups], dtype=np.int64)])
+        self._set_layout(identities, centroids, np.concatenate(groups) if groups else templates[:0], offsets,
+                         index, rerank)
+
+    def _set_layout(self, identities, centroids, templates, offsets, index, rerank):
+        self.templates = np.ascontiguousarray(templates, dtype=np.float32)
+        self.template_sq_norms = np.einsum('ij,ij->i', self.templates, self.templates)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.rerank = rerank
+        super().__init__(identities, centroids, index=index)
+
+    def save(self, path):
+        # Grouped, pruned templates and centroids as plain .npy files, so load() can map
+        # them: camera processes then share one copy in the page cache instead of each
+        # grouping the store into a private array. Written aside and renamed into place.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        for key, array in (('centroids', self.encodings), ('templates', self.templates), ('offsets', self.offsets)):
+            np.save(os.path.join(tmp_path, key + '.npy'), array)
+        with open(os.path.join(tmp_path, 'names.json'), 'w') as f:
+            json.dump(self.names, f)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another process saved the same layout first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, index=None, rerank=5):
+        # Returns None when there is no complete layout at path
+        try:
+            with open(os.path.join(path, 'names.json')) as f:
+                identities = json.load(f)
+            arrays = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode='r')
+                      for key in ('centroids', 'templates', 'offsets')}
+        except (OSError, ValueError):
+            return None
+        gallery = cls.__new__(cls)
+        gallery._set_layout(identities, arrays['centroids'], arrays['templates'], arrays['offsets'], index, rerank)
+        return gallery
+
+    def distances(self, vecs):
+        # Distance from every query to each person's nearest template
+        queries = np.asarray(vecs, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if len(self) == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        sq = squared_distances(queries, self.templates, self.template_sq_norms)
+        return np.sqrt(np.minimum.reduceat(sq, self.offsets[:-1], axis=1))
+
+    def search(self, vecs, k=1):
+        queries = np.asarray(vecs, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if len(self) == 0 or len(queries) == 0:
+            return ids, dists
+
+        candidate_ids, _ = self.index.search(queries, min(len(self), max(k, self.rerank)))
+        for i, candidates in enumerate(candidate_ids):
+            candidates = candidates[candidates >= 0]
+            if len(candidates) == 0:
+                continue
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in candidates])
+            starts = np.concatenate([[0], np.cumsum(self.offsets[candidates + 1] - self.offsets[candidates])[:-1]])
+            sq = squared_distances(queries[i:i + 1], self.templates[rows], self.template_sq_norms[rows])[0]
+            nearest = np.minimum.reduceat(sq, starts)
+            order = np.argsort(nearest)[:k]
+            ids[i, :len(order)] = candidates[order]
+            dists[i, :len(order)] = np.sqrt(nearest[order])
+        return ids, dists
@@ -1,49 +1,81 @@
-import os
 import time
+import threading
 import gspread
 from datetime import datetime
+from gspread.cell import Cell
+from gspread.utils import rowcol_to_a1, a1_to_rowcol
+from ratelimit import RateLimiter
+from store import identity_name, list_images
 
 def setup_gspread():
     gc = gspread.service_account(filename="gspread json/facialattendance-422303-6c0203fda5e3.json")
     return gc
 
 def get_names_from_folder(folder_path):
+    # One roster row per identity, however many photos it has, named the way enrolment names it
     names = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".png"):
-            name = os.path.splitext(filename)[0]
+    for filename in list_images(folder_path):
+        name = identity_name(filename)
+        if name not in names:
             names.append(name)
     return names
 
 def get_names_from_sheet(sheet, column_index=1):
-    names = sheet.col_values(column_index)
+    names = retry_on_rate_limit(sheet.col_values, column_index)
     return names
 
+# Shared by every sheet call in the process so they draw from one quota
+rate_limiter = RateLimiter()
+
+def paces_itself(func):
+    # A WorksheetCache paces the requests it really sends, its answers from memory cost no quota
+    return isinstance(getattr(func, '__self__', None), WorksheetCache)
+
 def retry_on_rate_limit(func, *args, **kwargs):
-    max_retries = 5
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            result = func(*args, **kwargs)
-            return result
-        except gspread.exceptions.APIError as e:
-            if e.response.status_code == 429:
-                wait_time = 60
-                print(f"Rate limit exceeded. Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-                retry_count += 1
-            else:
-                raise
-    raise Exception("Maximum retries exceeded")
+    if paces_itself(func):
+        return func(*args, **kwargs)
+    return rate_limiter.call(func, *args, **kwargs)
+
+def paced_once(func, *args, **kwargs):
+    # One paced attempt, a 429 is left to the caller's own backoff
+    if paces_itself(func):
+        return func(*args, **kwargs)
+    return rate_limiter.paced(func, *args, **kwargs)
+
+def changed_ranges(current, desired, start_row, column_index):
+    # Groups the cells that differ into contiguous ranges for one batch_update
+    length = max(len(current), len(desired))
+    current = current + [''] * (length - len(current))
+    desired = desired + [''] * (length - len(desired))
+
+    data = []
+    i = 0
+    while i < length:
+        if current[i] == desired[i]:
+            i += 1
+            continue
+        j = i
+        while j < length and current[j] != desired[j]:
+            j += 1
+        first = rowcol_to_a1(start_row + i, column_index)
+        last = rowcol_to_a1(start_row + j - 1, column_index)
+        data.append({'range': f"{first}:{last}", 'values': [[value] for value in desired[i:j]]})
+        i = j
+    return data
+
+def write_column(sheet, current, desired, start_row=2, column_index=1):
+    data = changed_ranges(current, desired, start_row, column_index)
+    if data:
+        retry_on_rate_limit(sheet.batch_update, data)
+    return len(data)
 
 def check_and_update_sheet(folder_path, sheet, column_index=1):
+    # One read of the column and at most one batch_update, whatever the roster size
     names_in_folder = sorted(get_names_from_folder(folder_path))
     names_in_sheet = get_names_from_sheet(sheet, column_index)
     
     if len(names_in_sheet) <= 1:
-        for i, name in enumerate(names_in_folder, start=2):
-            retry_on_rate_limit(sheet.update_cell, i, column_index, name)
+        write_column(sheet, names_in_sheet[1:], names_in_folder, 2, column_index)
         print("Google Sheet was empty. Populated with names from the folder.")
     else:
         names_in_sheet = names_in_sheet[1:]
@@ -52,8 +84,7 @@ def check_and_update_sheet(folder_path, sheet, column_index=1):
         if missing_names:
             print("Missing names in Google Sheet:", missing_names)
             all_names = sorted(set(names_in_sheet + missing_names))
-            for i, name in enumerate(all_names, start=2):
-                retry_on_rate_limit(sheet.update_cell, i, column_index, name)
+            write_column(sheet, names_in_sheet, all_names, 2, column_index)
         else:
             print("All names are present in the Google Sheet.")
 
@@ -80,17 +111,236 @@ def mark_attendance(sheet, name):
     else:
         print(f"Date {today} not found in the sheet.")
 
+SHEET_DATE_FORMATS = ("%B %d, %Y", "%b %d, %Y")
+
+def parse_sheet_date(value):
+    # Header dates are written as "Sep 7, 2024" by datepopulator, older sheets use "September 07, 2024"
+    for date_format in SHEET_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+def mark_attendance_bulk(sheet, names, day=None, column_index=1, call=retry_on_rate_limit, not_found=None):
+    # One read of the whole sheet and one batch_update for every name. Cells that are
+    # already 'x' are skipped, so rerunning it for the same session writes nothing.
+    # Returns the names it marked, or None when the sheet has no column for the day.
+    # Names without a row are appended to the not_found list when one is given.
+    day = day or datetime.now().date()
+    today = day.strftime("%B %d, %Y")
+    values = call(sheet.get_all_values)
+
+    header = values[0] if values else []
+    date_col = next((col for col, value in enumerate(header, start=1) if parse_sheet_date(value) == day), None)
+    if date_col is None:
+        print(f"Date {today} not found in the sheet.")
+        return None
+
+    rows = {}
+    for row, line in enumerate(values[1:], start=2):
+        if len(line) >= column_index and line[column_index - 1]:
+            rows.setdefault(line[column_index - 1], row)
+
+    data = []
+    marked = []
+    for name in sorted(set(names)):
+        row = rows.get(name)
+        if row is None:
+            print(f"Name {name} not found in the sheet.")
+            if not_found is not None:
+                not_found.append(name)
+            continue
+        line = values[row - 1]
+        if date_col <= len(line) and line[date_col - 1] == 'x':
+            print(f"Attendance for {name} on {today} has already been marked.")
+            continue
+        data.append({'range': rowcol_to_a1(row, date_col), 'values': [['x']]})
+        marked.append(name)
+
+    if data:
+        call(sheet.batch_update, data)
+        for name in marked:
+            print(f"Marked attendance for {name} on {today}")
+    return marked
+
+class WorksheetCache:
+    # Wraps a gspread Worksheet: the sheet is loaded once with get_all_values and every
+    # read is answered from memory, with name -> row and date -> column indices for
+    # lookups. Writes go to the sheet and the cached copy. The copy is reloaded after
+    # `ttl` seconds, on invalidate(), or when the optional `version` probe (a cheap
+    # callable returning a token, e.g. the spreadsheet's last update time) changes.
+    # Exposes the Worksheet methods this project uses, so it can be passed anywhere a sheet is.
+    # Only the requests that reach the sheet are paced, by `limiter` or the shared rate_limiter.
+    def __init__(self, sheet, ttl=300.0, version=None, name_column=1, clock=time.monotonic, limiter=None):
+        self.sheet = sheet
+        self.limiter = limiter
+        self.ttl = ttl
+        self.version = version
+        self.name_column = name_column
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.values = None
+        self.loaded_at = None
+        self.token = None
+        self.reads = 0
+
+    def _request(self, func, *args, **kwargs):
+        return (self.limiter or rate_limiter).call(func, *args, **kwargs)
+
+    def refresh(self):
+        with self.lock:
+            self.values = [list(row) for row in self._request(self.sheet.get_all_values)]
+            self.reads += 1
+            self.loaded_at = self.clock()
+            self.token = self.version() if self.version else None
+            self._index()
+
+    def invalidate(self):
+        with self.lock:
+            self.values = None
+
+    def _index(self):
+        self.rows = {}
+        for row, line in enumerate(self.values[1:], start=2):
+            if len(line) >= self.name_column and line[self.name_column - 1]:
+                self.rows.setdefault(line[self.name_column - 1], row)
+        self.columns = {}
+        self.dates = {}
+        for col, value in enumerate(self.values[0] if self.values else [], start=1):
+            if value:
+                self.columns.setdefault(value, col)
+                day = parse_sheet_date(value)
+                if day is not None:
+                    self.dates.setdefault(day, col)
+
+    def _ensure(self):
+        if self.values is None or self.clock() - self.loaded_at > self.ttl:
+            self.refresh()
+        elif self.version and self.version() != self.token:
+            self.refresh()
+
+    def _get(self, row, col):
+        if row <= len(self.values) and col <= len(self.values[row - 1]):
+            return self.values[row - 1][col - 1]
+        return ''
+
+    def _set(self, row, col, value):
+        value = '' if value is None else str(value)
+        while len(self.values) < row:
+            self.values.append([])
+        line = self.values[row - 1]
+        while len(line) < col:
+            line.append('')
+        line[col - 1] = value
+
+    def _wrote(self):
+        # Rewrites can move names (the roster is kept sorted), so rebuild the indices
+        if self.values is not None:
+            self._index()
+        # Our own write moves the version, take the new token so it does not force a reload
+        if self.version:
+            self.token = self.version()
+
+    def find_row(self, name):
+        with self.lock:
+            self._ensure()
+            return self.rows.get(name)
+
+    def find_date_column(self, day):
+        with self.lock:
+            self._ensure()
+            return self.dates.get(day)
+
+    def get_all_values(self):
+        with self.lock:
+            self._ensure()
+            return [list(row) for row in self.values]
+
+    def row_values(self, row):
+        with self.lock:
+            self._ensure()
+            values = list(self.values[row - 1]) if row <= len(self.values) else []
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def col_values(self, col):
+        with self.lock:
+            self._ensure()
+            values = [self._get(row, col) for row in range(1, len(self.values) + 1)]
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def cell(self, row, col):
+        with self.lock:
+            self._ensure()
+            return Cell(row, col, self._get(row, col) or None)
+
+    def range(self, first_row, first_col, last_row, last_col):
+        with self.lock:
+            self._ensure()
+            return [Cell(row, col, self._get(row, col)) for row in range(first_row, last_row + 1)
+                    for col in range(first_col, last_col + 1)]
+
+    def find(self, query):
+        with self.lock:
+            self._ensure()
+            if query in self.columns:
+                return Cell(1, self.columns[query], query)
+            for row, line in enumerate(self.values, start=1):
+                for col, value in enumerate(line, start=1):
+                    if value == query:
+                        return Cell(row, col, value)
+            return None
+
+    def update_cell(self, row, col, value):
+        with self.lock:
+            self._request(self.sheet.update_cell, row, col, value)
+            if self.values is not None:
+                self._set(row, col, value)
+            self._wrote()
+
+    def update_cells(self, cell_list):
+        with self.lock:
+            self._request(self.sheet.update_cells, cell_list)
+            if self.values is not None:
+                for cell in cell_list:
+                    self._set(cell.row, cell.col, cell.value)
+            self._wrote()
+
+    def _apply_range(self, range_name, values):
+        first_row, first_col = a1_to_rowcol(range_name.split(':')[0])
+        for r, line in enumerate(values):
+            for c, value in enumerate(line):
+                self._set(first_row + r, first_col + c, value)
+
+    def update(self, values=None, range_name=None):
+        with self.lock:
+            self._request(self.sheet.update, values=values, range_name=range_name)
+            if self.values is not None:
+                self._apply_range(range_name, values)
+            self._wrote()
+
+    def batch_update(self, data):
+        with self.lock:
+            self._request(self.sheet.batch_update, data)
+            if self.values is not None:
+                for item in data:
+                    self._apply_range(item['range'], item['values'])
+            self._wrote()
+
 def main():
     folder_path = "known_faces"
     client = setup_gspread()
     sheet_name = "gsheets test123"
     worksheet_index = 0
-    sheet = client.open(sheet_name).get_worksheet(worksheet_index)
+    sheet = WorksheetCache(client.open(sheet_name).get_worksheet(worksheet_index))
     check_and_update_sheet(folder_path, sheet)
     
     names_to_mark = ["Alice", "Bob"]
-    for name in names_to_mark:
-        mark_attendance(sheet, name)
+    mark_attendance_bulk(sheet, names_to_mark)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,143 @@
+import os
+import zipfile
+import hashlib
+import numpy as np
+
+def squared_distances(queries, encodings, sq_norms):
+    q_norms = np.einsum('ij,ij->i', queries, queries)
+    sq = q_norms[:, None] + sq_norms[None, :] - 2.0 * (queries @ encodings.T)
+    np.maximum(sq, 0, out=sq)
+    return sq
+
+def top_k(dists, k):
+    k = min(k, dists.shape[1])
+    if k < dists.shape[1]:
+        idx = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(dists.shape[1]), dists.shape).copy()
+    part = np.take_along_axis(dists, idx, axis=1)
+    order = np.argsort(part, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+def fingerprint(encodings):
+    return hashlib.sha1(np.ascontiguousarray(encodings, dtype=np.float32).tobytes()).hexdigest()
+
+class BruteForceIndex:
+    kind = 'brute'
+
+    def build(self, encodings):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        return self
+
+    def search(self, queries, k=1):
+        sq = squared_distances(queries, self.encodings, self.sq_norms)
+        ids, sq = top_k(sq, k)
+        return ids, np.sqrt(sq)
+
+    def state(self):
+        return {}
+
+    def load_state(self, encodings, state):
+        return self.build(encodings)
+
+class IVFIndex:
+    # Inverted file index: k-means partitions the gallery into n_lists cells and a
+    # query only scans the n_probe nearest cells. n_probe is the recall/latency knob.
+    kind = 'ivf'
+
+    def __init__(self, n_lists=None, n_probe=16, n_iter=10, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+
+    def build(self, encodings):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        n = len(self.encodings)
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        n_lists = max(1, min(n_lists, n))
+
+        rng = np.random.default_rng(self.seed)
+        # Train on a subsample, the centroids barely move past ~256 points per cell
+        sample_size = min(n, 256 * n_lists)
+        sample = self.encodings[rng.choice(n, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            c_norms = np.einsum('ij,ij->i', centroids, centroids)
+            assign = np.argmin(squared_distances(sample, centroids, c_norms), axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=n_lists)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+
+        self.centroids = centroids
+        self._assign_lists()
+        return self
+
+    def _assign_lists(self):
+        c_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        assign = np.argmin(squared_distances(self.encodings, self.centroids, c_norms), axis=1)
+        # CSR layout: entry ids grouped by cell, offsets[c]:offsets[c + 1] is cell c
+        self.order = np.argsort(assign, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(self.centroids)))])
+
+    def search(self, queries, k=1):
+        n_probe = min(self.n_probe, len(self.centroids))
+        c_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        probes, _ = top_k(squared_distances(queries, self.centroids, c_norms), n_probe)
+
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        dists = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for i, cells in enumerate(probes):
+            candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in cells])
+            if len(candidates) == 0:
+                continue
+            sq = squared_distances(queries[i:i + 1], self.encodings[candidates], self.sq_norms[candidates])
+            local, sq = top_k(sq, k)
+            ids[i, :local.shape[1]] = candidates[local[0]]
+            dists[i, :local.shape[1]] = np.sqrt(sq[0])
+        return ids, dists
+
+    def state(self):
+        return {'centroids': self.centroids, 'order': self.order, 'offsets': self.offsets}
+
+    def load_state(self, encodings, state):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        self.centroids = state['centroids']
+        self.order = state['order']
+        self.offsets = state['offsets']
+        self.n_lists = len(self.centroids)
+        return self
+
+INDEX_KINDS = {'brute': BruteForceIndex, 'ivf': IVFIndex}
+
+def make_index(kind='brute', **kwargs):
+    return INDEX_KINDS[kind](**kwargs)
+
+def save_index(index, path, encodings):
+    # Written aside and renamed into place, so a crash or a concurrent reader never sees half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, kind=np.array(index.kind), fingerprint=np.array(fingerprint(encodings)), **index.state())
+    os.replace(tmp_path, path)
+
+def load_index(path, encodings, n_probe=None):
+    # Returns None when the file is missing, unreadable or was built for a different gallery
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['fingerprint']) != fingerprint(encodings):
+                return None
+            state = {key: data[key] for key in data.files}
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+        print(f"Ignoring unreadable index {path}: {e}")
+        return None
+    index = make_index(str(state['kind']))
+    if n_probe is not None:
+        index.n_probe = n_probe
+    return index.load_state(encodings, state)
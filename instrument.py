@@ -0,0 +1,337 @@
+import io
+import os
+import sys
+import json
+import time
+import bisect
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Bucket upper bounds 10% apart from 10 us to about 100 s, so a percentile read
+# from the buckets is within 10% of the true value at a fixed memory cost
+BUCKET_BOUNDS = [1e-5 * 1.1 ** i for i in range(170)]
+PERCENTILES = (50, 95, 99)
+
+class Histogram:
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                break
+        return min(self.bounds[i] if i < len(self.bounds) else self.max, self.max)
+
+class Timer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+class Metrics:
+    # Per-stage latency histograms and event counters shared by every thread of a run
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = Counter()
+        self.started_at = time.perf_counter()
+
+    def timer(self, stage):
+        return Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def snapshot(self):
+        with self.lock:
+            stages = {stage: dict({'count': h.count, 'mean_ms': h.total / h.count * 1000, 'max_ms': h.max * 1000},
+                                  **{f'p{q}_ms': h.percentile(q) * 1000 for q in PERCENTILES})
+                      for stage, h in self.histograms.items()}
+            return {'uptime_s': time.perf_counter() - self.started_at, 'stages': stages,
+                    'counters': dict(self.counters)}
+
+    def log_line(self):
+        snapshot = self.snapshot()
+        stages = " ".join(f"{stage}={values['p50_ms']:.1f}/{values['p95_ms']:.1f}/{values['p99_ms']:.1f}ms"
+                          for stage, values in snapshot['stages'].items())
+        counters = " ".join(f"{name}={value}" for name, value in sorted(snapshot['counters'].items()))
+        return f"[metrics {snapshot['uptime_s']:.0f}s] p50/p95/p99 {stages} {counters}".rstrip()
+
+    def write_json(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    def prometheus_text(self, prefix='faceid'):
+        with self.lock:
+            lines = [f"# TYPE {prefix}_stage_seconds summary"]
+            for stage, h in sorted(self.histograms.items()):
+                for q in PERCENTILES:
+                    lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q / 100}"}} {h.percentile(q):.6f}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {h.total:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class NullMetrics:
+    # Disabled mode: same interface, every call returns straight away
+    enabled = False
+
+    def timer(self, stage):
+        return NULL_TIMER
+
+    def observe(self, stage, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def snapshot(self):
+        return {'uptime_s': 0.0, 'stages': {}, 'counters': {}}
+
+    def log_line(self):
+        return "[metrics disabled]"
+
+    def write_json(self, path):
+        pass
+
+    def prometheus_text(self, prefix='faceid'):
+        return ""
+
+def make_metrics(enabled=True):
+    return Metrics() if enabled else NullMetrics()
+
+class Reporter:
+    # Background thread that prints a log line and/or rewrites a JSON file every interval
+    def __init__(self, metrics, interval=10.0, json_path=None, log=True):
+        self.metrics = metrics
+        self.interval = interval
+        self.json_path = json_path
+        self.log = log
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def report(self):
+        if self.log:
+            print(self.metrics.log_line())
+        if self.json_path:
+            self.metrics.write_json(self.json_path)
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.report()
+
+def serve_metrics(metrics, port=9464, host='127.0.0.1'):
+    # Prometheus text on /metrics and the raw snapshot on /metrics.json, localhost only by default
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = metrics.prometheus_text().encode(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(metrics.snapshot()).encode(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def dump_profile(profiler, path=None, top=25, sort='cumulative'):
+    if path:
+        profiler.dump_stats(path)
+        print(f"Profile written to {path}")
+    else:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(top)
+        print(out.getvalue())
+
+@contextmanager
+def profile(path=None, top=25, sort='cumulative'):
+    # Opt-in cProfile around a block: dumps to `path` for snakeviz/pstats, or prints the top entries
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        dump_profile(profiler, path, top, sort)
+
+class Sampler:
+    # Low-overhead alternative to cProfile for the threaded pipeline: samples every
+    # thread's current stack on a timer and counts where time is spent
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.leaves = Counter()
+        self.inclusive = Counter()
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.samples += 1
+                self.leaves[self._label(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    label = self._label(frame)
+                    if label not in seen:
+                        seen.add(label)
+                        self.inclusive[label] += 1
+                    frame = frame.f_back
+
+    def _label(self, frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def report(self, top=20):
+        if not self.samples:
+            print("No samples")
+            return
+        print(f"{self.samples} samples, self time:")
+        for label, n in self.leaves.most_common(top):
+            print(f"  {n / self.samples:6.1%}  {label}")
+        print("Inclusive time:")
+        for label, n in self.inclusive.most_common(top):
+            print(f"  {n / self.samples:6.1%}  {label}")
+
+def add_arguments(parser, report_interval=30.0):
+    # The same opt-in instrumentation flags on every entry point, read back by Instrumentation.from_args
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument('--no-metrics', action='store_true', help="turn the stage timers and counters off")
+    group.add_argument('--report-interval', type=float, default=report_interval,
+                       help="seconds between metrics log lines, 0 for none")
+    group.add_argument('--metrics-json', help="rewrite this file with a metrics snapshot on every report")
+    group.add_argument('--metrics-port', type=int, help="serve Prometheus text on this localhost port")
+    group.add_argument('--profile', nargs='?', const='', metavar='PATH',
+                       help="run under cProfile, dump to PATH or print the top entries at exit")
+    group.add_argument('--sample', action='store_true', help="sample every thread's stack and print where time goes")
+
+class Instrumentation:
+    # Starts whatever the flags asked for around a run: metrics (NullMetrics when off),
+    # the periodic reporter, the Prometheus endpoint, cProfile on the calling thread and
+    # the stack sampler. stop() shuts them down and prints the final reports.
+    def __init__(self, enabled=True, report_interval=0, json_path=None, port=None, profile_path=None, sample=False):
+        self.metrics = make_metrics(enabled)
+        self.report_interval = report_interval if enabled else 0
+        self.json_path = json_path
+        self.port = port if enabled else None
+        self.profile_path = profile_path
+        self.reporter = None
+        self.server = None
+        self.profiler = cProfile.Profile() if profile_path is not None else None
+        self.sampler = Sampler() if sample else None
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(not args.no_metrics, args.report_interval, args.metrics_json, args.metrics_port, args.profile,
+                   args.sample)
+
+    def start(self):
+        if self.report_interval or self.json_path:
+            self.reporter = Reporter(self.metrics, self.report_interval or 30.0, self.json_path,
+                                     log=bool(self.report_interval)).start()
+        if self.port:
+            self.server = serve_metrics(self.metrics, self.port)
+            print(f"Metrics on http://127.0.0.1:{self.port}/metrics")
+        if self.sampler is not None:
+            self.sampler.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            dump_profile(self.profiler, self.profile_path or None)
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler.report()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.reporter is not None:
+            self.reporter.stop()
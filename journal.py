@@ -0,0 +1,161 @@
+import time
+import sqlite3
+import threading
+from datetime import date
+from gsheets import mark_attendance_bulk, paced_once
+from ratelimit import backoff_delay
+
+JOURNAL_FILENAME = 'attendance_journal.db'
+
+class AttendanceJournal:
+    # Durable local record of confirmed attendance. Events are committed as soon as
+    # they are recorded, so a crash loses nothing, and stay pending until the sheet has them.
+    def __init__(self, path=JOURNAL_FILENAME):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS events (
+                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 name TEXT NOT NULL,
+                                 day TEXT NOT NULL,
+                                 recorded_at REAL NOT NULL,
+                                 synced_at REAL,
+                                 parked TEXT,
+                                 UNIQUE (name, day))""")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(events)")]
+        if 'parked' not in columns:
+            self.conn.execute("ALTER TABLE events ADD COLUMN parked TEXT")
+
+    def record(self, name, day=None):
+        # Returns False when the name was already recorded for that day
+        day = (day or date.today()).isoformat()
+        with self.lock:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO events (name, day, recorded_at) VALUES (?, ?, ?)",
+                                       (name, day, time.time()))
+        return cursor.rowcount == 1
+
+    def pending(self, limit=500):
+        with self.lock:
+            rows = self.conn.execute("SELECT id, name, day FROM events WHERE synced_at IS NULL AND parked IS NULL "
+                                     "ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(event_id, name, date.fromisoformat(day)) for event_id, name, day in rows]
+
+    def mark_synced(self, ids):
+        with self.lock:
+            self.conn.executemany("UPDATE events SET synced_at = ? WHERE id = ?", [(time.time(), i) for i in ids])
+
+    def park(self, ids, reason):
+        # Set aside events the sheet cannot take, so they stop blocking the ones behind them
+        with self.lock:
+            self.conn.executemany("UPDATE events SET parked = ? WHERE id = ?", [(reason, i) for i in ids])
+
+    def parked(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT id, name, day, parked FROM events WHERE synced_at IS NULL "
+                                     "AND parked IS NOT NULL ORDER BY id").fetchall()
+        return [(event_id, name, date.fromisoformat(day), reason) for event_id, name, day, reason in rows]
+
+    def unpark(self):
+        # Returns the parked events to the pending queue, e.g. once the missing date columns exist
+        with self.lock:
+            cursor = self.conn.execute("UPDATE events SET parked = NULL WHERE synced_at IS NULL AND parked IS NOT NULL")
+        return cursor.rowcount
+
+    def names(self, day=None):
+        day = (day or date.today()).isoformat()
+        with self.lock:
+            return [name for (name,) in self.conn.execute("SELECT name FROM events WHERE day = ? ORDER BY id", (day,))]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class SheetSync:
+    # Background worker that drains the journal to the sheet, one batched write per
+    # day per round, paced by the shared rate limiter. Failures back off exponentially
+    # with jitter instead of blocking the camera loop, and anything left pending is
+    # picked up again after a restart. Events for a day without a sheet column are
+    # parked with the reason rather than retried, and get one more try on the next start.
+    def __init__(self, journal, sheet, interval=5.0, batch_size=500, base_delay=1.0, max_delay=300.0):
+        self.journal = journal
+        self.sheet = sheet
+        self.interval = interval
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.synced = 0
+        self.parked = 0
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        retried = self.journal.unpark()
+        if retried:
+            print(f"Retrying {retried} parked attendance events")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def record(self, name, day=None):
+        # Journals a confirmed attendance and wakes the worker to push it
+        if self.journal.record(name, day):
+            self.wake.set()
+
+    def stop(self, timeout=30.0):
+        # Drains what it can before returning, whatever is left stays pending for the next run
+        self.stopping.set()
+        self.wake.set()
+        self.thread.join(timeout)
+
+    def backoff(self):
+        return backoff_delay(self.failures - 1, self.base_delay, self.max_delay)
+
+    def sync_once(self):
+        events = self.journal.pending(self.batch_size)
+        by_day = {}
+        for event_id, name, day in events:
+            by_day.setdefault(day, []).append((event_id, name))
+        for day, day_events in by_day.items():
+            ids = [event_id for event_id, _ in day_events]
+            not_found = []
+            if mark_attendance_bulk(self.sheet, [name for _, name in day_events], day, call=paced_once,
+                                    not_found=not_found) is None:
+                self._park(ids, f"no column for {day} in the sheet")
+                continue
+            # Names the sheet does not know yet wait for a roster fix instead of being dropped
+            missing = [event_id for event_id, name in day_events if name in not_found]
+            if missing:
+                self._park(missing, "name not in sheet")
+            self.journal.mark_synced([event_id for event_id in ids if event_id not in missing])
+            self.synced += len(ids) - len(missing)
+        return len(events)
+
+    def _park(self, ids, reason):
+        print(f"Parked {len(ids)} attendance events: {reason}")
+        self.journal.park(ids, reason)
+        self.parked += len(ids)
+
+    def _run(self):
+        while True:
+            try:
+                drained = self.sync_once()
+                self.failures = 0
+            except Exception as e:
+                self.failures += 1
+                delay = self.backoff()
+                if self.stopping.is_set():
+                    print(f"Attendance sync failed ({e}), pending events are kept for the next run")
+                    return
+                print(f"Attendance sync failed ({e}), retrying in {delay:.1f} seconds...")
+                # A stop during the wait cuts it short for one final attempt
+                self.stopping.wait(delay)
+                continue
+
+            if self.stopping.is_set() and not self.journal.pending(1):
+                return
+            if drained < self.batch_size:
+                self.wake.wait(self.interval)
+                self.wake.clear()
@@ -0,0 +1,76 @@
+import os
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from instrument import Histogram
+
+def load_payloads(folder, limit):
+    # Encoded images to send, a fixed-seed frame when no folder is given
+    if folder:
+        names = sorted(name for name in os.listdir(folder) if not name.startswith('.'))[:limit]
+        payloads = []
+        for name in names:
+            with open(os.path.join(folder, name), 'rb') as f:
+                payloads.append(f.read())
+        return payloads
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, size=(480, 640, 3), dtype=np.uint8)
+    return [cv2.imencode('.jpg', frame)[1].tobytes()]
+
+def send(url, payload, timeout):
+    request = urllib.request.Request(url, data=payload, headers={'Content-Type': 'image/jpeg'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except OSError:
+        return 'error'
+
+def run(url, payloads, requests, concurrency, timeout=30.0):
+    latencies = Histogram()
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def one(i):
+        start = time.perf_counter()
+        status = send(url, payloads[i % len(payloads)], timeout)
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[status] += 1
+            if status == 200:
+                latencies.observe(elapsed)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    return time.perf_counter() - started_at, latencies, statuses
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the recognition service on localhost")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/recognize?vote=0')
+    parser.add_argument('--images', help="folder of images to send, a generated frame otherwise")
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.images, args.limit)
+    print(f"{'clients':>7} {'req/s':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'ok':>5} {'503':>5} {'other':>5}")
+    for concurrency in args.concurrency:
+        elapsed, latencies, statuses = run(args.url, payloads, args.requests, concurrency)
+        other = sum(n for status, n in statuses.items() if status not in (200, 503))
+        print(f"{concurrency:>7} {statuses[200] / elapsed:>7.1f} {latencies.percentile(50) * 1000:>7.1f} "
+              f"{latencies.percentile(95) * 1000:>7.1f} {latencies.percentile(99) * 1000:>7.1f} "
+              f"{statuses[200]:>5} {statuses[503]:>5} {other:>5}")
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,36 @@
-import os
+import argparse
 import cv2
-import time
-from datetime import datetime
-from faceid import load_image, create_database, detect_faces, save_database, load_database, consistent_faces
-from gsheets import setup_gspread, check_and_update_sheet, mark_attendance
+from faceid import sync_database, build_gallery, VoteAccumulator
+from gsheets import setup_gspread, check_and_update_sheet, WorksheetCache, rate_limiter
 from datepopulator import populate_dates
+from pipeline import Pipeline
+from journal import AttendanceJournal, SheetSync
+from instrument import Instrumentation, add_arguments
+from cache import EmbeddingCache
 
 def main():
-    faces = load_database()
+    parser = argparse.ArgumentParser(description="Recognize faces from the webcam and mark attendance")
+    parser.add_argument('--cache', action='store_true',
+                        help="recognize every frame and reuse encodings of unchanged faces, instead of tracking between keyframes")
+    add_arguments(parser)
+    args = parser.parse_args()
 
-    if not faces:
-        filenames = os.listdir('known_faces')
-        images = [load_image(f'known_faces/{filename}') for filename in filenames]
-        faces = create_database(filenames, images)
-        save_database(faces)
-
-    frame_count = -1
-    prev_frame_time = 0
-    total_frame_time = []
-    detected_faces = {}
+    faces = sync_database('known_faces')
+    gallery = build_gallery(faces)
 
     client = setup_gspread()
     sheet_name = "Attendance Tracker"
     worksheet_index = 0
-    sheet = client.open(sheet_name).get_worksheet(worksheet_index)
+    # Reads are served from one get_all_values, writes go through to the sheet
+    sheet = WorksheetCache(client.open(sheet_name).get_worksheet(worksheet_index))
     folder_path = "known_faces"
     check_and_update_sheet(folder_path, sheet)
 
     # Check and populate dates if needed
-    if not sheet.row_values(1):
+    header = sheet.row_values(1)
+    if not header:
         date_range = input("Enter the date range (YYYY-MM-DD to YYYY-MM-DD): ")
-        populate_dates(sheet, date_range)
+        populate_dates(sheet, date_range, header=header)
 
     else:
         print("Dates already populated in the Google Sheet.")
@@ -39,40 +39,35 @@ def main():
     cap.set(3, 640)
     cap.set(4, 480)
 
-    while True:
-        ret, image = cap.read()
-        if ret:
-            frame_time = time.time() - prev_frame_time
-            prev_frame_time = time.time()
-            total_frame_time.append(frame_time)
-            image_display = image.copy()
-
-            if frame_count % 1 == 0:
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                image_display = detect_faces(image, faces, detected_faces, threshold=0.6)
-                image_display = cv2.cvtColor(image_display, cv2.COLOR_RGB2BGR)
-                frame_time = time.time() - prev_frame_time
-                prev_frame_time = time.time()
-                total_frame_time.append(frame_time)
+    # Confirmed attendance is journalled locally right away and pushed to the sheet in the background
+    sync = SheetSync(AttendanceJournal(), sheet).start()
+    # Timers are on by default, one summary line every 30 s instead of a print per frame
+    instrumentation = Instrumentation.from_args(args).start()
+    metrics = instrumentation.metrics
+    votes = VoteAccumulator(threshold=0.6, min_frames=20, on_confirm=sync.record)
+    cache = EmbeddingCache() if args.cache else None
+    pipeline = Pipeline(cap, gallery, votes, threshold=0.6, keyframe_interval=None if args.cache else 10,
+                        metrics=metrics, cache=cache).start()
 
-            cv2.imshow('image', image_display)
-            print("Time taken for each frame:", frame_time)
+    while True:
+        image_display = pipeline.render(timeout=0.1)
+        with metrics.timer('display'):
+            if image_display is not None:
+                cv2.imshow('image', image_display)
+            key = cv2.waitKey(1) & 0xFF
 
-        frame_count += 1
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            total_frame_time.remove(total_frame_time[0])
-            print("Average frame time:", sum(total_frame_time) / frame_count)
+        if key == ord('q'):
             break
 
-    today = datetime.now().strftime("%B %d, %Y").replace(", 2024", "")
+    pipeline.stop()
+    instrumentation.stop()
+    pipeline.report()
 
-    if not consistent_faces:
+    if not votes.confirmed:
         print("Nothing Added to the Google Sheet")
-        
-    else:
-        for name, count in consistent_faces.items():
-            if name != 'Unknown Face Detected':
-                mark_attendance(sheet, name)
+
+    sync.stop()
+    print("Google Sheets requests:", rate_limiter.metrics())
 
     cap.release()
     cv2.destroyAllWindows()
@@ -1,10 +1,10 @@
 import os
 import cv2
 import face_recognition
-import numpy as np
 from tqdm import tqdm
 import time
 import pickle
+from gallery import Gallery, as_gallery
 
 class Face:
     def __init__(self, bounding_box, cropped_face, name, feature_vector):
@@ -43,13 +43,11 @@ def detect_faces(image_test, faces, threshold=0.6, unknown_threshold=0.55):
     name_percentages = {}
     unknown_detected = False
 
-    for loc_test, vec_test in zip(locs_test, vecs_test):
-        distances = []
-        for face in faces:
-            distance = face_recognition.face_distance([vec_test], face.feature_vector)
-            distances.append(distance)
+    gallery = as_gallery(faces)
+    pred_names, min_distances = gallery.match(vecs_test, k=1)
 
-        min_distance = np.min(distances)
+    for loc_test, names, distances in zip(locs_test, pred_names, min_distances):
+        min_distance = distances[0]
         match_percentage = (1 - min_distance) * 100  # Convert distance to percentage match
 
         if match_percentage / 100 < threshold:
@@ -60,8 +58,7 @@ def detect_faces(image_test, faces, threshold=0.6, unknown_threshold=0.55):
                 pred_name = 'Unknown Face Detected'
                 unknown_detected = True
             else:
-                pred_index = np.argmin(distances)
-                pred_name = faces[pred_index].name
+                pred_name = names[0]
 
             # Update counts and percentages
             if pred_name not in name_counts:
@@ -143,6 +140,8 @@ if __name__ == "__main__":
         # Save the database for future use
         save_database(faces)
 
+    gallery = Gallery.from_faces(faces)
+
     # Open webcam
     cap = cv2.VideoCapture(0)
     cap.set(3, 640)
@@ -163,7 +162,7 @@ if __name__ == "__main__":
             # Process every 10th frame
             if frame_count % 1 == 0:
                 image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                image_display = detect_faces(image, faces, threshold=0.6)
+                image_display = detect_faces(image, gallery, threshold=0.6)
                 image_display = cv2.cvtColor(image_display, cv2.COLOR_RGB2BGR)
 
                 # Calculate the time taken to capture each frame
@@ -0,0 +1,261 @@
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+import cv2
+from faceid import locate_faces, classify_matches, sync_database, build_gallery, VoteAccumulator
+from gallery import ENCODING_SIZE
+from pipeline import LatestQueue
+from encoder import EncodingService, locate_chips
+
+def open_source(source):
+    # Device indices are given as plain integers, anything else is a file path or URL
+    return cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+
+def init_worker():
+    # The CPU budget is the pool size, keep OpenCV from spawning threads of its own
+    cv2.setNumThreads(1)
+
+class Source:
+    def __init__(self, source_id, source, realtime=True):
+        self.id = source_id
+        self.source = source
+        self.cap = open_source(source)
+        self.is_device = str(source).isdigit()
+        self.realtime = realtime
+        self.frames = LatestQueue(maxsize=1)
+        self.in_flight = False
+        self.finished = False
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.faces = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def capture(self, running):
+        # Files are paced at their native frame rate so they behave like a live camera
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if not self.is_device else 0
+        interval = 1 / fps if self.realtime and fps and fps > 0 else 0
+        next_at = time.perf_counter()
+        while running.is_set():
+            ret, image = self.cap.read()
+            if not ret:
+                if self.is_device:
+                    time.sleep(0.01)
+                    continue
+                break
+            self.frames.put((time.perf_counter(), image))
+            self.frames_captured += 1
+            if interval:
+                next_at += interval
+                time.sleep(max(0, next_at - time.perf_counter()))
+        self.finished = True
+        self.cap.release()
+
+class RecognitionServer:
+    # One process for N sources: capture threads keep the freshest frame per source,
+    # a round-robin scheduler hands frames to a process pool for HOG + encoding (at
+    # most one frame in flight per source), and a matcher thread pools the encodings
+    # from all sources into batches scored against one shared gallery. With
+    # batch_encode the workers stop at aligned chips and an EncodingService runs
+    # the network once per micro-batch of chips from every source.
+    def __init__(self, sources, gallery, cpus=None, batch_size=32, batch_wait=0.02,
+                 threshold=0.6, unknown_threshold=0.55, min_frames=20, detect_scale=1.0, realtime=True,
+                 batch_encode=False):
+        self.sources = [Source(i, source, realtime) for i, source in enumerate(sources)]
+        self.gallery = gallery
+        self.cpus = cpus or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.threshold = threshold
+        self.unknown_threshold = unknown_threshold
+        self.detect_scale = detect_scale
+        self.encoder = EncodingService(batch_size, batch_wait) if batch_encode else None
+
+        # Capture times are perf_counter readings, the votes decay on the same clock
+        self.votes = VoteAccumulator(threshold, min_frames, clock=time.perf_counter)
+        self.detections = queue.Queue()
+        self.slots = threading.Semaphore(self.cpus)
+        self.running = threading.Event()
+        self.threads = []
+        self.pool = None
+        self.started_at = None
+        self.batches = 0
+        self.batched_faces = 0
+
+    def start(self):
+        self.running.set()
+        self.started_at = time.perf_counter()
+        self.pool = multiprocessing.Pool(self.cpus, initializer=init_worker)
+        if self.encoder is not None:
+            self.encoder.start()
+        self.threads = [threading.Thread(target=source.capture, args=(self.running,), daemon=True)
+                        for source in self.sources]
+        self.threads.append(threading.Thread(target=self._schedule, daemon=True))
+        self.threads.append(threading.Thread(target=self._match, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running.clear()
+        for source in self.sources:
+            source.frames.close()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.pool.terminate()
+        self.pool.join()
+        if self.encoder is not None:
+            self.encoder.stop()
+
+    def done(self):
+        return all(source.finished and not source.in_flight and not source.frames.items for source in self.sources)
+
+    def _schedule(self):
+        turn = 0
+        while self.running.is_set():
+            submitted = False
+            for offset in range(len(self.sources)):
+                source = self.sources[(turn + offset) % len(self.sources)]
+                if source.in_flight or not source.frames.items:
+                    continue
+                if not self.slots.acquire(timeout=0.1):
+                    break
+                # Marked before the dequeue, so done() never sees the frame neither queued nor in flight
+                source.in_flight = True
+                frame = source.frames.get(timeout=0)
+                if frame is None:
+                    source.in_flight = False
+                    self.slots.release()
+                    continue
+                captured_at, image = frame
+                rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                locate = locate_chips if self.encoder is not None else locate_faces
+                self.pool.apply_async(locate, (rgb, self.detect_scale),
+                                      callback=lambda result, s=source, t=captured_at: self._detected(s, t, result),
+                                      error_callback=lambda error, s=source: self._failed(s, error))
+                submitted = True
+            # Start the next pass one source later so no source is always served first
+            turn = (turn + 1) % len(self.sources)
+            if not submitted:
+                time.sleep(0.002)
+
+    def _detected(self, source, captured_at, result):
+        self.slots.release()
+        if self.encoder is None:
+            self.detections.put((source, captured_at, result))
+            return
+        locs_test, chips = result
+        future = self.encoder.submit(chips)
+        future.add_done_callback(lambda f: self._encoded(source, captured_at, locs_test, f))
+
+    def _encoded(self, source, captured_at, locs_test, future):
+        try:
+            vecs_test = future.result()
+        except Exception as e:
+            self._failed_encoding(source, e)
+            return
+        self.detections.put((source, captured_at, (locs_test, vecs_test)))
+
+    def _failed_encoding(self, source, error):
+        print(f"Source {source.id}: encoding failed: {error}")
+        source.in_flight = False
+
+    def _failed(self, source, error):
+        print(f"Source {source.id}: recognition failed: {error}")
+        self.slots.release()
+        source.in_flight = False
+
+    def _match(self):
+        while self.running.is_set():
+            try:
+                batch = [self.detections.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.perf_counter() + self.batch_wait
+            faces = len(batch[0][2][0])
+            while faces < self.batch_size:
+                try:
+                    item = self.detections.get(timeout=max(0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                batch.append(item)
+                faces += len(item[2][0])
+            self._match_batch(batch)
+
+    def _match_batch(self, batch):
+        vecs = np.array([vec for _, _, (locs_test, vecs_test) in batch for vec in vecs_test],
+                        dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        pred_names, min_distances = self.gallery.match(vecs, k=1)
+        self.batches += 1
+        self.batched_faces += len(vecs)
+
+        start = 0
+        now = time.perf_counter()
+        for source, captured_at, (locs_test, vecs_test) in batch:
+            end = start + len(locs_test)
+            results = classify_matches(locs_test, pred_names[start:end], min_distances[start:end],
+                                       self.threshold, self.unknown_threshold)
+            start = end
+            self.votes.update(results, now=captured_at)
+            latency = now - captured_at
+            source.frames_processed += 1
+            source.faces += len(results)
+            source.latency_total += latency
+            source.latency_max = max(source.latency_max, latency)
+            source.in_flight = False
+
+    def metrics(self):
+        elapsed = time.perf_counter() - self.started_at
+        return [{'source': str(source.source),
+                 'captured_fps': source.frames_captured / elapsed,
+                 'processed_fps': source.frames_processed / elapsed,
+                 'faces': source.faces,
+                 'mean_latency_ms': source.latency_total / source.frames_processed * 1000 if source.frames_processed else 0.0,
+                 'max_latency_ms': source.latency_max * 1000}
+                for source in self.sources]
+
+    def report(self):
+        for row in self.metrics():
+            print(f"{row['source']}: captured {row['captured_fps']:.1f} FPS, processed {row['processed_fps']:.1f} FPS, "
+                  f"{row['faces']} faces, latency mean {row['mean_latency_ms']:.0f} ms / max {row['max_latency_ms']:.0f} ms")
+        if self.batches:
+            print(f"Matched {self.batched_faces} faces in {self.batches} batches "
+                  f"({self.batched_faces / self.batches:.1f} faces/batch) on {self.cpus} CPUs")
+        if self.encoder is not None and self.encoder.batches:
+            stats = self.encoder.stats()
+            print(f"Encoded {stats['encoded']} faces in {stats['batches']} batches ({stats['mean_batch']:.1f} faces/batch)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognize faces from several cameras in one process")
+    parser.add_argument('sources', nargs='+', help="device index, video file or stream URL")
+    parser.add_argument('--cpus', type=int, default=None, help="worker processes for detection and encoding")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batch-wait', type=float, default=0.02, help="seconds to wait for a batch to fill")
+    parser.add_argument('--detect-scale', type=float, default=1.0)
+    parser.add_argument('--report-every', type=float, default=10.0)
+    parser.add_argument('--no-realtime', action='store_true', help="read files as fast as possible")
+    parser.add_argument('--batch-encode', action='store_true', help="encode chips from all sources in shared batches")
+    args = parser.parse_args()
+
+    gallery = build_gallery(sync_database('known_faces'))
+    server = RecognitionServer(args.sources, gallery, cpus=args.cpus, batch_size=args.batch_size,
+                               batch_wait=args.batch_wait, detect_scale=args.detect_scale,
+                               realtime=not args.no_realtime, batch_encode=args.batch_encode).start()
+    try:
+        next_report = time.perf_counter() + args.report_every
+        while not server.done():
+            time.sleep(0.1)
+            if time.perf_counter() >= next_report:
+                server.report()
+                next_report += args.report_every
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    server.report()
+    print("Attendance:", server.votes.attendance())
+
+if __name__ == "__main__":
+    main()
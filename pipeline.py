@@ -0,0 +1,212 @@
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+import cv2
+from faceid import (locate_faces, detect_locations, encode_locations, match_faces, recognize_faces, draw_results,
+                    UNKNOWN_NAME)
+from tracker import FaceTracker
+from instrument import Metrics
+
+log = logging.getLogger(__name__)
+
+class LatestQueue:
+    # Bounded queue that drops the oldest item instead of blocking the producer,
+    # consumers always work on the freshest frames
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            return self.items.popleft() if self.items else None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class Pipeline:
+    # capture thread -> drop-oldest queue -> inference threads (HOG + encoding in a
+    # process pool, matching here) -> latest results, drawn by the caller on the
+    # freshest frame so the display runs at camera rate. With keyframe_interval set,
+    # a single inference thread runs a FaceTracker instead of full recognition per frame.
+    def __init__(self, cap, gallery, votes, workers=1, threshold=0.6, unknown_threshold=0.55,
+                 detect_scale=1.0, keyframe_interval=None, metrics=None, cache=None):
+        self.cap = cap
+        self.gallery = gallery
+        # faceid.VoteAccumulator, confirmation and its callback live there
+        self.votes = votes
+        self.workers = workers
+        self.threshold = threshold
+        self.unknown_threshold = unknown_threshold
+        self.detect_scale = detect_scale
+        # Optional cache.EmbeddingCache, only used without a tracker, which already skips re-encoding
+        self.cache = cache
+        self.tracker = None
+        if keyframe_interval:
+            # Tracking needs every frame in order, so only one inference thread
+            self.workers = 1
+            self.tracker = FaceTracker(gallery, keyframe_interval, threshold=threshold,
+                                       unknown_threshold=unknown_threshold, detect_scale=detect_scale,
+                                       detect=self._pool_detect, encode=self._pool_encode)
+
+        # Pass instrument.NullMetrics() to turn the timers off
+        self.stats = metrics if metrics is not None else Metrics()
+        self.inference_queue = LatestQueue(maxsize=1)
+        self.display_queue = LatestQueue(maxsize=1)
+        self.results_lock = threading.Lock()
+        self.results = []
+        self.results_frame_id = -1
+        self.running = False
+        self.threads = []
+        self.pool = None
+        self.started_at = None
+        self.frames_captured = 0
+        self.frames_inferred = 0
+        self.frames_displayed = 0
+
+    def start(self):
+        self.running = True
+        self.started_at = time.perf_counter()
+        self.pool = multiprocessing.Pool(self.workers)
+        self.threads = [threading.Thread(target=self._capture, daemon=True)]
+        self.threads += [threading.Thread(target=self._infer, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.inference_queue.close()
+        self.display_queue.close()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.pool.terminate()
+        self.pool.join()
+
+    def _pool_detect(self, image, detect_scale):
+        with self.stats.timer('detect'):
+            return self.pool.apply(detect_locations, (image, detect_scale))
+
+    def _pool_encode(self, image, locs):
+        with self.stats.timer('encode'):
+            return self.pool.apply(encode_locations, (image, locs))
+
+    def _capture(self):
+        frame_id = 0
+        while self.running:
+            start = time.perf_counter()
+            ret, image = self.cap.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            self.stats.observe('capture', time.perf_counter() - start)
+            frame = (frame_id, time.perf_counter(), image)
+            self.inference_queue.put(frame)
+            self.display_queue.put(frame)
+            self.frames_captured += 1
+            self.stats.count('frames_captured')
+            frame_id += 1
+
+    def _infer(self):
+        while self.running:
+            frame = self.inference_queue.get(timeout=0.5)
+            if frame is None:
+                continue
+            frame_id, captured_at, image = frame
+
+            with self.stats.timer('convert'):
+                rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            try:
+                if self.tracker is not None:
+                    with self.stats.timer('track'):
+                        results = self.tracker.process(rgb)
+                    encoded = self.tracker.encoded
+                elif self.cache is not None:
+                    encoded = []
+                    with self.stats.timer('recognize'):
+                        results = recognize_faces(rgb, self.gallery, self.threshold, self.unknown_threshold,
+                                                  self.detect_scale, self.cache, self._pool_detect, self._pool_encode,
+                                                  encoded)
+                else:
+                    with self.stats.timer('detect_encode'):
+                        locs_test, vecs_test = self.pool.apply(locate_faces, (rgb, self.detect_scale))
+                    with self.stats.timer('match'):
+                        results = match_faces(locs_test, vecs_test, self.gallery, self.threshold, self.unknown_threshold)
+                    encoded = results
+            except Exception:
+                if not self.running:
+                    return  # pool terminated during shutdown
+                # One bad frame must not kill the thread and freeze the overlays
+                log.exception("Inference failed on frame %d", frame_id)
+                self.stats.count('inference_errors')
+                continue
+
+            unknown = sum(1 for _, name, _ in results if name == UNKNOWN_NAME)
+            self.stats.count('faces_seen', len(results))
+            self.stats.count('matches', len(results) - unknown)
+            self.stats.count('unknown', unknown)
+
+            # A face votes only when it was encoded on this frame, a name carried forward by
+            # the tracker or answered from the cache is not another match
+            self.votes.update(encoded)
+            with self.results_lock:
+                self.frames_inferred += 1
+                self.stats.count('frames_inferred')
+                # Workers can finish out of order, never replace newer results with older ones
+                if frame_id > self.results_frame_id:
+                    self.results = results
+                    self.results_frame_id = frame_id
+            self.stats.observe('inference_latency', time.perf_counter() - captured_at)
+
+    def latest_results(self):
+        with self.results_lock:
+            return self.results
+
+    def render(self, timeout=1.0):
+        # Returns the freshest frame with the latest overlays, or None if no new frame arrived
+        frame = self.display_queue.get(timeout=timeout)
+        if frame is None:
+            return None
+        frame_id, captured_at, image = frame
+        with self.stats.timer('render'):
+            image_display = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            with self.stats.timer('draw'):
+                image_display = draw_results(image_display, self.latest_results())
+            image_display = cv2.cvtColor(image_display, cv2.COLOR_RGB2BGR)
+        self.stats.observe('display_latency', time.perf_counter() - captured_at)
+        self.frames_displayed += 1
+        self.stats.count('frames_displayed')
+        return image_display
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started_at
+        snapshot = self.stats.snapshot()
+        print(f"Captured {self.frames_captured} frames in {elapsed:.1f} s: "
+              f"display {self.frames_displayed / elapsed:.1f} FPS, recognition {self.frames_inferred / elapsed:.1f} FPS")
+        print(f"Dropped frames: inference {self.inference_queue.dropped}, display {self.display_queue.dropped}")
+        if self.tracker is not None:
+            print("Tracker:", ", ".join(f"{key} {value:.2f}" if isinstance(value, float) else f"{key} {value}"
+                                        for key, value in self.tracker.stats().items()))
+        if self.cache is not None:
+            stats = self.cache.stats()
+            print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}), "
+                  f"{stats['evictions']} evictions, {stats['size']} entries")
+        for stage, values in snapshot['stages'].items():
+            print(f"  {stage:>18}: p50 {values['p50_ms']:.1f} ms, p95 {values['p95_ms']:.1f} ms, "
+                  f"p99 {values['p99_ms']:.1f} ms, max {values['max_ms']:.1f} ms ({values['count']} samples)")
+        if snapshot['counters']:
+            print("Counters:", ", ".join(f"{name} {value}" for name, value in sorted(snapshot['counters'].items())))
@@ -0,0 +1,109 @@
+import time
+import random
+import threading
+import gspread
+
+# Google Sheets allows 60 requests per minute per user
+SHEETS_REQUESTS_PER_MINUTE = 60
+
+class RateLimitExceeded(Exception):
+    pass
+
+class FakeClock:
+    # Drop-in for the clock/sleep pair, time only moves when something sleeps
+    def __init__(self, start=0.0):
+        self.now = start
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += max(0.0, seconds)
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=64.0, rng=random.random):
+    # Exponential backoff with jitter, attempt counts from 0
+    delay = min(max_delay, base_delay * 2 ** attempt)
+    return delay * (0.5 + 0.5 * rng())
+
+def is_rate_limited(error):
+    return isinstance(error, gspread.exceptions.APIError) and error.response.status_code == 429
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        # Blocks until `tokens` are available, returns the seconds spent waiting
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+class RateLimiter:
+    # Client-side pacing for every Sheets request: a token bucket sized to the
+    # per-minute quota keeps us under it, and a 429 that still slips through is
+    # retried with jittered exponential backoff instead of a fixed one-minute sleep.
+    def __init__(self, requests_per_minute=SHEETS_REQUESTS_PER_MINUTE, burst=None, max_retries=8,
+                 base_delay=1.0, max_delay=64.0, clock=time.monotonic, sleep=time.sleep, rng=random.random):
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst or max(1, requests_per_minute // 6), clock, sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.throttled = 0
+        self.retried = 0
+        self.paced_seconds = 0.0
+
+    def paced(self, func, *args, **kwargs):
+        # Waits for a token and makes the call once, errors are left to the caller
+        waited = self.bucket.acquire()
+        with self.lock:
+            self.sent += 1
+            self.paced_seconds += waited
+        return func(*args, **kwargs)
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return self.paced(func, *args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if not is_rate_limited(e):
+                    raise
+                with self.lock:
+                    self.throttled += 1
+                if attempt >= self.max_retries:
+                    raise RateLimitExceeded(f"Rate limited after {attempt + 1} attempts") from e
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay, self.rng)
+                print(f"Rate limit exceeded. Retrying in {delay:.1f} seconds...")
+                self.sleep(delay)
+                with self.lock:
+                    self.retried += 1
+                attempt += 1
+
+    def metrics(self):
+        with self.lock:
+            return {'sent': self.sent, 'throttled': self.throttled, 'retried': self.retried,
+                    'paced_seconds': round(self.paced_seconds, 3)}
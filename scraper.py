@@ -2,57 +2,66 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import time
-import requests
+from selenium.common.exceptions import TimeoutException
+from downloader import Downloader
+from enrol import StreamingEnroller
 
-# Create a new instance of the Chrome driver
-driver = webdriver.Chrome()
+URL = 'https://app.slack.com/client/TCKE4QSG5/'
+DETAILS_SELECTOR = ".c-button-unstyled.p-avatar_stack--details"
+PROFILE_IMAGE_XPATH = '/html/body/div[10]/div/div/div[2]/div[2]/div/div[2]/div[1]/div/div/div[1]/div/div/div[4]/button/div/div/div/div/span/span/img'
+IMAGES_XPATH = './ancestor::div/div/div[4]/button/div/div/div/div/span/span/img'
 
-# Navigate to the Slack URL
-url = 'https://app.slack.com/client/TCKE4QSG5/'
-driver.get(url)
-time.sleep(30)
+def find_images(driver, timeout=10):
+    # Find the profile image container
+    profile_container = WebDriverWait(driver, timeout).until(
+        EC.presence_of_element_located((By.XPATH, PROFILE_IMAGE_XPATH))
+    )
+    # Get all profile images
+    return profile_container.find_elements(By.XPATH, IMAGES_XPATH)
 
-def capture_images():
+def capture_images(driver, downloader):
+    # Queues every avatar on screen, the downloader skips URLs it has already seen
     try:
-        # Find the profile image container
-        profile_container = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, '/html/body/div[10]/div/div/div[2]/div[2]/div/div[2]/div[1]/div/div/div[1]/div/div/div[4]/button/div/div/div/div/span/span/img'))
-        )
-        
-        # Get all profile images
-        images = profile_container.find_elements(By.XPATH, './ancestor::div/div/div[4]/button/div/div/div/div/span/span/img')
-        
-        # Download first 9 images
-        for i, img in enumerate(images[:9]):
+        images = find_images(driver)
+        for img in images:
             src = img.get_attribute('src')
-            download_image(src, f"image_{i+1}.png")
+            if src:
+                # The avatar's alt text is the member's name, it becomes the enrolled identity
+                downloader.submit(src, img.get_attribute('alt') or None)
 
-        # Scroll down to load more messages
+        # Scroll down to load more, and wait for new images instead of a fixed pause
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(2)  # Short pause to allow new data to load
+        try:
+            WebDriverWait(driver, 5).until(lambda d: len(find_images(d)) > len(images))
+        except TimeoutException:
+            pass
 
     except Exception as e:
         print(f"An error occurred: {e}")
 
-def download_image(src, filename):
-    # Request the image content
-    response = requests.get(src)
-    
-    # Save the image to disk
-    with open(filename, 'wb') as file:
-        file.write(response.content)
-    print(f"Downloaded image: {filename}")
-
-# Perform an action on the element to view details
-details_element = WebDriverWait(driver, 10).until(
-    EC.presence_of_element_located((By.CSS_SELECTOR, ".c-button-unstyled.p-avatar_stack--details"))
-)
-details_element.click()
-time.sleep(5)
-
-for _ in range(10):  # Adjust the range based on expected number of scrolls needed
-    capture_images()
-
-# Close the driver when done
-driver.quit()
\ No newline at end of file
+def main(folder='known_faces', scrolls=10, login_timeout=300):
+    # Every saved image goes straight to the encoders, enrolment ends soon after the last download
+    enroller = StreamingEnroller(folder)
+    driver = webdriver.Chrome()
+    downloader = Downloader(folder, on_saved=enroller.submit)
+    try:
+        # Navigate to the Slack URL, the wait covers signing in by hand
+        driver.get(URL)
+        details_element = WebDriverWait(driver, login_timeout).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, DETAILS_SELECTOR))
+        )
+        # Perform an action on the element to view details
+        details_element.click()
+        find_images(driver)
+
+        for _ in range(scrolls):  # Adjust the range based on expected number of scrolls needed
+            capture_images(driver, downloader)
+    finally:
+        # Close the driver when done, downloads still in flight are finished first
+        driver.quit()
+        downloader.close()
+        enroller.close()
+    downloader.report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import hashlib
+import base64
+import argparse
+import threading
+import multiprocessing
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import cv2
+from faceid import (locate_faces, detect_locations, encode_locations, match_faces, recognize_faces, create_face,
+                    sync_database, load_database, build_gallery, VoteAccumulator)
+from store import safe_name, write_atomic
+from instrument import Metrics
+from cache import EmbeddingCache
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+# Leading bytes of the formats cv2.imdecode reads, to name saved uploads
+IMAGE_SIGNATURES = ((b'\x89PNG', '.png'), (b'\xff\xd8', '.jpg'), (b'BM', '.bmp'), (b'RIFF', '.webp'))
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def init_worker():
+    # The pool size is the CPU budget, keep OpenCV from spawning threads of its own
+    cv2.setNumThreads(1)
+
+def decode_image(data):
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ServiceError(400, "body is not a decodable image")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+def image_extension(data):
+    return next((extension for signature, extension in IMAGE_SIGNATURES if data.startswith(signature)), '.jpg')
+
+class RecognitionService:
+    # Headless recognizer: the gallery is loaded once, HOG and encoding run in a
+    # process pool, matching runs on the request thread. At most max_pending requests
+    # are admitted at a time, anything beyond is refused straight away so callers
+    # back off instead of queueing unbounded work. With a cache.EmbeddingCache, faces
+    # unchanged since an earlier request reuse its encoding; it suits one client
+    # streaming one camera, crops from different cameras rarely pass its hash check.
+    # Enrolled photos are saved to folder/<name>/ and recorded like synced files, so the
+    # folder stays the source of truth and sync_database keeps them; without a folder
+    # the service only recognizes.
+    def __init__(self, store, processes=None, max_pending=None, threshold=0.6, unknown_threshold=0.55,
+                 min_frames=20, detect_scale=1.0, cache=None, folder=None):
+        self.store = store
+        self.folder = folder
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_pending = max_pending or self.processes * 2
+        self.threshold = threshold
+        self.unknown_threshold = unknown_threshold
+        self.detect_scale = detect_scale
+        self.cache = cache
+        self.gallery = build_gallery(store)
+        self.votes = VoteAccumulator(threshold, min_frames)
+        self.metrics = Metrics()
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        # Enrol and remove rewrite the store and swap in a new gallery, readers keep whichever they started with
+        self.store_lock = threading.Lock()
+        self.pool = multiprocessing.Pool(self.processes, initializer=init_worker)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def admit(self):
+        with self.pending_lock:
+            if self.pending >= self.max_pending:
+                self.metrics.count('rejected')
+                raise ServiceError(503, "server busy, retry later")
+            self.pending += 1
+
+    def release(self):
+        with self.pending_lock:
+            self.pending -= 1
+
+    def _pool_detect(self, image, detect_scale):
+        with self.metrics.timer('detect'):
+            return self.pool.apply(detect_locations, (image, detect_scale))
+
+    def _pool_encode(self, image, locs):
+        with self.metrics.timer('encode'):
+            return self.pool.apply(encode_locations, (image, locs))
+
+    def recognize(self, data, vote=True):
+        image = decode_image(data)
+        if self.cache is not None:
+            # Cached answers are shown but only fresh encodings vote
+            encoded = []
+            with self.metrics.timer('recognize'):
+                results = recognize_faces(image, self.gallery, self.threshold, self.unknown_threshold, self.detect_scale,
+                                          self.cache, self._pool_detect, self._pool_encode, encoded)
+        else:
+            with self.metrics.timer('detect_encode'):
+                locs_test, vecs_test = self.pool.apply(locate_faces, (image, self.detect_scale))
+            with self.metrics.timer('match'):
+                results = match_faces(locs_test, vecs_test, self.gallery, self.threshold, self.unknown_threshold)
+            encoded = results
+        confirmed = self.votes.update(encoded) if vote else []
+        self.metrics.count('faces_seen', len(results))
+        return {'faces': [{'box': [int(v) for v in loc], 'name': name, 'match': round(float(match_percentage), 2)}
+                          for loc, name, match_percentage in results],
+                'confirmed': confirmed}
+
+    def enrol(self, name, data):
+        if self.folder is None:
+            raise ServiceError(409, "enrolment needs a faces folder, start the service with --folder")
+        folder_name = safe_name(name)
+        if not folder_name:
+            raise ServiceError(400, "name cannot be used as a folder name")
+        image = decode_image(data)
+        with self.metrics.timer('enrol_encode'):
+            face = self.pool.apply(create_face, (name, image))
+        if face is None:
+            raise ServiceError(422, "no face found in the image")
+        digest = hashlib.sha1(data).hexdigest()
+        filename = os.path.join(folder_name, digest[:16] + image_extension(data))
+        path = os.path.join(self.folder, filename)
+        with self.store_lock:
+            write_atomic(path, data)
+            stat = os.stat(path)
+            entry_id = self.store.add(folder_name, face.feature_vector, face.cropped_face,
+                                      bounding_box=[int(v) for v in face.bounding_box], source=filename,
+                                      size=stat.st_size, mtime=stat.st_mtime, sha1=digest)
+            self._commit()
+        return {'id': entry_id, 'name': folder_name, 'templates': self.store.names.count(folder_name)}
+
+    def remove(self, name=None, ids=None):
+        with self.store_lock:
+            entries = [entry for entry in self.store.entries if entry['name'] == name or entry['id'] in (ids or [])]
+            if not entries:
+                raise ServiceError(404, "no such identity")
+            # The photos go too, or the next sync would enrol them again
+            for entry in entries:
+                if self.folder is not None and 'source' in entry:
+                    try:
+                        os.remove(os.path.join(self.folder, entry['source']))
+                    except FileNotFoundError:
+                        pass
+            ids = [entry['id'] for entry in entries]
+            self.store.remove(ids)
+            self._commit()
+        return {'removed': sorted(ids)}
+
+    def _commit(self):
+        self.store.save()
+        self.gallery = build_gallery(self.store)
+
+    def attendance(self):
+        with self.votes.lock:
+            confirmed = {name: dict(info) for name, info in self.votes.confirmed.items()}
+        return {'confirmed': confirmed, 'active': self.votes.scores()}
+
+    def health(self):
+        health = {'identities': len(self.gallery), 'templates': len(self.store),
+                  'pending': self.pending, 'max_pending': self.max_pending}
+        if self.cache is not None:
+            health['cache'] = self.cache.stats()
+        return health
+
+class Handler(BaseHTTPRequestHandler):
+    # JSON in and out, images are sent either as the raw request body or base64 in a JSON "image" field
+    service = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._respond(200, self.service.health())
+        elif path == '/attendance':
+            self._respond(200, self.service.attendance())
+        elif path == '/metrics':
+            self._respond_text(200, self.service.metrics.prometheus_text())
+        else:
+            self._respond(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        routes = {'/recognize': self._recognize, '/enrol': self._enrol, '/remove': self._remove}
+        route = routes.get(url.path)
+        if route is None:
+            self._respond(404, {'error': 'not found'})
+            return
+        start = time.perf_counter()
+        try:
+            body = self._read_body()
+            self.service.admit()
+            try:
+                result = route(body, parse_qs(url.query))
+            finally:
+                self.service.release()
+        except ServiceError as e:
+            self._respond(e.status, {'error': str(e)})
+            return
+        except Exception as e:
+            self._respond(500, {'error': str(e)})
+            return
+        self.service.metrics.observe(url.path.strip('/'), time.perf_counter() - start)
+        self._respond(200, result)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            # Not read, so the connection cannot be reused
+            self.close_connection = True
+            raise ServiceError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+        data = self.rfile.read(length)
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                body = json.loads(data or b'{}')
+            except ValueError:
+                raise ServiceError(400, "invalid JSON")
+            if not isinstance(body, dict):
+                raise ServiceError(400, "JSON body must be an object")
+            return body
+        return {'image': data}
+
+    def _image(self, body):
+        image = body.get('image')
+        if not image:
+            raise ServiceError(400, "missing image")
+        if isinstance(image, str):
+            try:
+                return base64.b64decode(image)
+            except ValueError:
+                raise ServiceError(400, "image is not valid base64")
+        return image
+
+    def _recognize(self, body, query):
+        vote = query.get('vote', ['1'])[0] != '0'
+        return self.service.recognize(self._image(body), vote=vote)
+
+    def _enrol(self, body, query):
+        name = body.get('name') or query.get('name', [None])[0]
+        if not name:
+            raise ServiceError(400, "missing name")
+        return self.service.enrol(name, self._image(body))
+
+    def _remove(self, body, query):
+        name = body.get('name') or query.get('name', [None])[0]
+        ids = body.get('ids') or [int(i) for i in query.get('id', [])]
+        if not name and not ids:
+            raise ServiceError(400, "missing name or ids")
+        return self.service.remove(name, ids)
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_text(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(service, host='127.0.0.1', port=8080):
+    handler = type('ServiceHandler', (Handler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless recognition service with a local HTTP/JSON API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--folder', default='known_faces',
+                        help="synced into the store before serving and where enrolled photos are saved, '' for neither")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--max-pending', type=int, default=None, help="requests admitted at once, the rest get 503")
+    parser.add_argument('--min-frames', type=int, default=20)
+    parser.add_argument('--detect-scale', type=float, default=1.0)
+    parser.add_argument('--cache', action='store_true', help="reuse encodings of faces unchanged since an earlier request")
+    args = parser.parse_args()
+
+    store = sync_database(args.folder) if args.folder else load_database()
+    service = RecognitionService(store, args.processes, args.max_pending, min_frames=args.min_frames,
+                                 detect_scale=args.detect_scale, cache=EmbeddingCache() if args.cache else None,
+                                 folder=args.folder or None)
+    server = serve(service, args.host, args.port)
+    print(f"Serving {len(service.gallery)} identities on http://{args.host}:{args.port} "
+          f"({service.processes} processes, {service.max_pending} pending requests max)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    service.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import os
+import re
+import sys
+import json
+import pickle
+import numpy as np
+from gallery import Gallery, ENCODING_SIZE
+
+STORE_DIRNAME = 'faces_store'
+ENTRIES_FILENAME = 'entries.json'
+
+def identity_name(filename):
+    # known_faces/alice/2.jpg and known_faces/alice.2.jpg both enrol a template of "alice"
+    parts = filename.replace(os.sep, '/').split('/')
+    return parts[0] if len(parts) > 1 else filename.split('.')[0]
+
+def list_images(folder_path):
+    # Paths relative to folder_path, one level of per-person subfolders.
+    # Dotfiles are bookkeeping (the downloader manifest, partial downloads), not images
+    filenames = []
+    for name in os.listdir(folder_path):
+        if name.startswith('.'):
+            continue
+        if os.path.isdir(os.path.join(folder_path, name)):
+            filenames.extend(os.path.join(name, inner) for inner in os.listdir(os.path.join(folder_path, name))
+                             if not inner.startswith('.'))
+        else:
+            filenames.append(name)
+    return sorted(filenames)
+
+def safe_name(name):
+    # A person's name as a folder name: no path separators, no leading dot that would hide it
+    return re.sub(r'[\\/:*?"<>|\x00-\x1f]+', '_', name).strip().lstrip('.')
+
+def write_atomic(path, data):
+    # Hidden while partial, so a concurrent sync_database never reads half an image
+    folder, name = os.path.split(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, '.' + name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class FaceStore:
+    # On-disk layout:
+    #   entries.json              name/ID table plus the name of the live embeddings file
+    #   embeddings-<version>.npy  float32 (N, 128), row i belongs to entries[i]
+    #   crops/<id>.npy            optional face crops, only read on demand
+    #   gallery-<version>/        the matching gallery, grouped by person (faceid.build_gallery)
+    # A save writes a new embeddings file and then swaps entries.json, so readers
+    # never see a half-written store and processes that still map the old file keep it.
+    def __init__(self, path=STORE_DIRNAME):
+        self.path = path
+        self.version = 0
+        self.next_id = 0
+        self.entries = []
+        self.meta = {}
+        self._embeddings = np.zeros((0, ENCODING_SIZE), dtype=np.float32)
+        self._pending_rows = []
+        self.pending_crops = {}
+        self.removed_ids = set()
+        # True once add or remove changed the store since it was opened or saved
+        self.modified = False
+
+    @classmethod
+    def open(cls, path=STORE_DIRNAME, mmap=True):
+        store = cls(path)
+        for _ in range(3):
+            try:
+                with open(os.path.join(path, ENTRIES_FILENAME)) as f:
+                    table = json.load(f)
+            except FileNotFoundError:
+                return store
+            try:
+                if table['entries']:
+                    # mmap keeps the load zero-copy and lets every camera process share the page cache
+                    store._embeddings = np.load(os.path.join(path, table['embeddings']), mmap_mode='r' if mmap else None)
+                break
+            except FileNotFoundError:
+                # Another process saved between reading the table and the matrix, reread the table
+                continue
+        store.version = table['version']
+        store.next_id = table['next_id']
+        store.entries = table['entries']
+        store.meta = table.get('meta', {})
+        return store
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def embeddings(self):
+        # Added rows are buffered so bulk enrolment does not copy the matrix once per face
+        if self._pending_rows:
+            self._embeddings = np.concatenate([self._embeddings] + self._pending_rows)
+            self._pending_rows = []
+        return self._embeddings
+
+    @property
+    def names(self):
+        return [entry['name'] for entry in self.entries]
+
+    @property
+    def ids(self):
+        return [entry['id'] for entry in self.entries]
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, ENTRIES_FILENAME))
+
+    def add(self, name, feature_vector, cropped_face=None, **meta):
+        entry_id = self.next_id
+        self.next_id += 1
+        self.modified = True
+        self.entries.append(dict(meta, id=entry_id, name=name))
+        self._pending_rows.append(np.asarray(feature_vector, dtype=np.float32).reshape(1, ENCODING_SIZE))
+        if cropped_face is not None:
+            self.pending_crops[entry_id] = cropped_face
+        return entry_id
+
+    def remove(self, ids):
+        ids = set(ids)
+        self.modified = True
+        keep = [i for i, entry in enumerate(self.entries) if entry['id'] not in ids]
+        self.removed_ids |= ids & set(self.ids)
+        self.entries = [self.entries[i] for i in keep]
+        self._embeddings = np.asarray(self.embeddings)[keep]
+        for entry_id in ids:
+            self.pending_crops.pop(entry_id, None)
+
+    def clear(self):
+        self.remove(self.ids)
+
+    def crop(self, entry_id):
+        if entry_id in self.pending_crops:
+            return self.pending_crops[entry_id]
+        try:
+            return np.load(self._crop_path(entry_id), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+    def _crop_path(self, entry_id):
+        return os.path.join(self.path, 'crops', f'{entry_id}.npy')
+
+    def save(self):
+        os.makedirs(os.path.join(self.path, 'crops'), exist_ok=True)
+        for entry_id, cropped_face in self.pending_crops.items():
+            np.save(self._crop_path(entry_id), np.asarray(cropped_face))
+
+        old_embeddings = self._embeddings_filename(self.version)
+        self.version += 1
+        embeddings_filename = self._embeddings_filename(self.version)
+        np.save(os.path.join(self.path, embeddings_filename), np.ascontiguousarray(self.embeddings, dtype=np.float32))
+
+        table = {'version': self.version, 'next_id': self.next_id,
+                 'embeddings': embeddings_filename, 'entries': self.entries, 'meta': self.meta}
+        tmp_path = os.path.join(self.path, ENTRIES_FILENAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(table, f)
+        os.replace(tmp_path, os.path.join(self.path, ENTRIES_FILENAME))
+
+        try:
+            os.remove(os.path.join(self.path, old_embeddings))
+        except FileNotFoundError:
+            pass
+        for entry_id in self.removed_ids:
+            try:
+                os.remove(self._crop_path(entry_id))
+            except FileNotFoundError:
+                pass
+        self.pending_crops = {}
+        self.removed_ids = set()
+        self.modified = False
+
+    def _embeddings_filename(self, version):
+        return f'embeddings-{version}.npy'
+
+    def gallery(self, index=None):
+        return Gallery(self.names, self.embeddings, index=index)
+
+class _PickledFace:
+    pass
+
+class _FaceUnpickler(pickle.Unpickler):
+    # Pickles written by main.py reference faceid.Face, the standalone scripts
+    # reference __main__.Face; read both without importing face_recognition
+    def find_class(self, module, name):
+        if name == 'Face':
+            return _PickledFace
+        return super().find_class(module, name)
+
+def migrate_pickle(pkl_path='faces_database.pkl', store_path=STORE_DIRNAME):
+    with open(pkl_path, 'rb') as f:
+        faces = _FaceUnpickler(f).load()
+
+    store = FaceStore.open(store_path)
+    store.clear()
+    for face in faces:
+        store.add(face.name, face.feature_vector, getattr(face, 'cropped_face', None),
+                  bounding_box=[int(v) for v in face.bounding_box])
+    store.save()
+    print(f"Migrated {len(faces)} faces from {pkl_path} to {store_path}")
+    return store
+
+if __name__ == "__main__":
+    migrate_pickle(*sys.argv[1:])
@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import RateLimiter, FakeClock
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def limiter(monkeypatch, clock):
+    # Sheets calls share gsheets.rate_limiter, swap in one that never really sleeps
+    import gsheets
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+    monkeypatch.setattr(gsheets, 'rate_limiter', limiter)
+    return limiter
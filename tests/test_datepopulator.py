@@ -0,0 +1,24 @@
+import re
+from datetime import date
+import numpy as np
+import pytest
+
+pytest.importorskip('oauth2client')
+from datepopulator import parse_holidays, session_dates, format_sessions
+
+def test_parse_holidays_accepts_commas_and_newlines():
+    assert parse_holidays('2024-09-07, 2024-09-14\n2024-12-25\n') == [date(2024, 9, 7), date(2024, 9, 14),
+                                                                        date(2024, 12, 25)]
+    assert parse_holidays('  ') == []
+
+@pytest.mark.parametrize('text, bad', [('2024-02-30', "Holiday 1 ('2024-02-30')"),
+                                       ('2024-09-07, 09/14/2024', "Holiday 2 ('09/14/2024')"),
+                                       ('2024-09-07\n2024-13-01', "Holiday 2 ('2024-13-01')")])
+def test_parse_holidays_names_the_bad_entry(text, bad):
+    with pytest.raises(ValueError, match=re.escape(bad)):
+        parse_holidays(text)
+
+def test_no_session_weekdays_gives_no_dates():
+    days = session_dates(date(2024, 9, 1), date(2024, 9, 30), weekdays=())
+    assert days.dtype == np.dtype('datetime64[D]') and len(days) == 0
+    assert format_sessions(days) == []
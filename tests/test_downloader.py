@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from downloader import Downloader, MANIFEST_FILENAME
+
+class ImageServer:
+    # Local stand-in for the avatar host: serves bytes per path with an ETag and answers 304 when it matches
+    def __init__(self):
+        self.images = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, self.headers.get('If-None-Match')))
+                if self.path not in server.images:
+                    self.send_error(404)
+                    return
+                body = server.images[self.path]
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}{path}'
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def server():
+    server = ImageServer()
+    yield server
+    server.close()
+
+def download(folder, urls, names=None):
+    with Downloader(str(folder), workers=4) as downloader:
+        paths = downloader.download_all(urls, names)
+    return paths, downloader.counts
+
+def saved_files(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), folder) for root, _, names in os.walk(folder)
+                  for name in names if not name.startswith('.'))
+
+def test_images_are_saved_under_the_persons_name(tmp_path, server):
+    server.images = {'/a/512.jpg': b'alice', '/avatars/bob_512.jpg': b'bob'}
+    paths, counts = download(tmp_path, [server.url('/a/512.jpg'), server.url('/avatars/bob_512.jpg')],
+                             ['Alice Smith', None])
+    assert counts['downloaded'] == 2
+    alice = os.path.join('Alice Smith', hashlib.sha256(b'alice').hexdigest()[:16] + '.jpg')
+    bob = os.path.join('bob_512', hashlib.sha256(b'bob').hexdigest()[:16] + '.jpg')
+    assert saved_files(tmp_path) == sorted([alice, bob])
+    assert (tmp_path / alice).read_bytes() == b'alice'
+
+def test_same_bytes_behind_two_urls_are_saved_once(tmp_path, server):
+    server.images = {'/one.jpg': b'same', '/two.jpg': b'same'}
+    download(tmp_path, [server.url('/one.jpg')], ['alice'])
+    paths, counts = download(tmp_path, [server.url('/two.jpg')], ['alice'])
+    assert paths == []
+    assert counts['duplicate'] == 1
+    assert len(saved_files(tmp_path)) == 1
+    manifest = json.loads((tmp_path / MANIFEST_FILENAME).read_text())
+    assert manifest['urls'][server.url('/one.jpg')]['filename'] == manifest['urls'][server.url('/two.jpg')]['filename']
+
+def test_rerun_sends_conditional_requests(tmp_path, server):
+    server.images = {'/alice.jpg': b'alice'}
+    url = server.url('/alice.jpg')
+    download(tmp_path, [url], ['alice'])
+    paths, counts = download(tmp_path, [url], ['alice'])
+    assert paths == []
+    assert counts['not_modified'] == 1
+    assert server.requests[0][1] is None
+    assert server.requests[1][1] == '"' + hashlib.md5(b'alice').hexdigest() + '"'
+
+def test_changed_image_replaces_the_old_file(tmp_path, server):
+    server.images = {'/alice.jpg': b'old'}
+    url = server.url('/alice.jpg')
+    download(tmp_path, [url], ['alice'])
+    server.images['/alice.jpg'] = b'new'
+    paths, counts = download(tmp_path, [url])
+    assert counts['downloaded'] == 1
+    assert saved_files(tmp_path) == [os.path.join('alice', hashlib.sha256(b'new').hexdigest()[:16] + '.jpg')]
+    manifest = json.loads((tmp_path / MANIFEST_FILENAME).read_text())
+    assert list(manifest['hashes']) == [hashlib.sha256(b'new').hexdigest()]
+
+def test_failed_download_is_counted(tmp_path, server):
+    paths, counts = download(tmp_path, [server.url('/missing.jpg')])
+    assert paths == []
+    assert counts['failed'] == 1
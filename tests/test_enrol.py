@@ -0,0 +1,46 @@
+import os
+import threading
+import numpy as np
+import cv2
+import pytest
+
+pytest.importorskip('face_recognition')
+from enrol import StreamingEnroller
+from faceid import sync_database
+
+def test_vanished_file_does_not_stall_the_stream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / 'known_faces'
+    (folder / 'alice').mkdir(parents=True)
+    cv2.imwrite(str(folder / 'alice' / '1.png'), np.zeros((64, 64, 3), dtype=np.uint8))
+
+    enroller = StreamingEnroller(str(folder), processes=1)
+    enroller.submit(str(folder / 'gone.png'))
+    enroller.submit(str(folder / 'alice' / '1.png'))
+    closer = threading.Thread(target=enroller.close, daemon=True)
+    closer.start()
+    closer.join(timeout=60)
+
+    assert not closer.is_alive()
+    assert enroller.counts['failed'] == 1
+    assert enroller.counts['enrolled'] + enroller.counts['no_face'] == 1
+
+def test_duplicate_is_enrolled_once_its_match_is_gone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / 'known_faces'
+    (folder / 'alice').mkdir(parents=True)
+    image = np.random.default_rng(0).integers(0, 255, size=(64, 64, 3), dtype=np.uint8)
+    for name in ('a.png', 'b.png'):
+        cv2.imwrite(str(folder / 'alice' / name), image)
+
+    enroller = StreamingEnroller(str(folder), processes=1)
+    for name in ('a.png', 'b.png'):
+        enroller.submit(str(folder / 'alice' / name))
+    enroller.close()
+    if enroller.counts['enrolled'] != 1:
+        pytest.skip("the face_recognition here found no face in the test image")
+    assert enroller.counts['duplicate'] == 1
+
+    (folder / 'alice' / 'a.png').unlink()
+    store = sync_database(str(folder), processes=1)
+    assert [entry['source'] for entry in store.entries] == [os.path.join('alice', 'b.png')]
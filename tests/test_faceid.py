@@ -0,0 +1,97 @@
+from datetime import date
+import numpy as np
+import pytest
+
+pytest.importorskip('face_recognition')
+from faceid import VoteAccumulator, UNKNOWN_NAME, recognize_faces
+from cache import EmbeddingCache
+from gallery import Gallery
+
+BOX = (10, 60, 60, 10)
+
+def run(votes, fps, stride, confidence, seconds=60.0, name='alice'):
+    # Feeds a recording where `name` is in every frame, sampled every `stride` frames
+    confirmed_at = None
+    for frame in range(0, int(seconds * fps), stride):
+        if votes.update([(BOX, name, confidence * 100)], now=frame / fps) and confirmed_at is None:
+            confirmed_at = frame / fps
+    return confirmed_at
+
+@pytest.mark.parametrize('fps', [10, 15, 30, 60])
+@pytest.mark.parametrize('stride', [1, 5, 15, 20, 30])
+@pytest.mark.parametrize('confidence', [0.61, 0.65, 0.8, 1.0])
+def test_confirms_after_min_frames_at_any_sampling_rate(fps, stride, confidence):
+    votes = VoteAccumulator(threshold=0.6, min_frames=20, window=60.0)
+    confirmed_at = run(votes, fps, stride, confidence)
+    assert votes.attendance() == ['alice']
+    # Confirmed on the 20th sampled frame
+    assert confirmed_at == pytest.approx(19 * stride / fps)
+
+def test_confidence_below_threshold_never_confirms():
+    votes = VoteAccumulator(threshold=0.6, min_frames=20)
+    assert run(votes, 30, 1, 0.59) is None
+    assert run(votes, 30, 1, 0.9, name=UNKNOWN_NAME) is None
+    assert votes.attendance() == []
+
+@pytest.mark.parametrize('spacing', [3.5, 10.0, 100.0, 150.0])
+def test_sparse_sightings_never_add_up(spacing):
+    # 20 sightings spread wider than the window, with or without idle resets in between
+    votes = VoteAccumulator(threshold=0.6, min_frames=20, window=60.0, idle_timeout=120.0)
+    for i in range(40):
+        votes.update([(BOX, 'alice', 90.0)], now=i * spacing)
+    assert votes.attendance() == []
+
+def test_sightings_further_apart_than_idle_timeout_start_over():
+    votes = VoteAccumulator(threshold=0.6, min_frames=20, idle_timeout=120.0)
+    for i in range(3):
+        votes.update([(BOX, 'alice', 90.0)], now=i * 150.0)
+    assert votes.active['alice'][3] == 1
+
+def test_confirms_once_min_frames_fit_in_the_window():
+    # One fresh encoding every 3 s, as with tracker re-verification, confirms on the 20th
+    votes = VoteAccumulator(threshold=0.6, min_frames=20, window=60.0)
+    confirmed_at = None
+    for i in range(30):
+        if votes.update([(BOX, 'alice', 90.0)], now=i * 3.0):
+            confirmed_at = i * 3.0
+    assert confirmed_at == 57.0
+
+def test_confirms_once_and_keeps_counting():
+    confirmed = []
+    votes = VoteAccumulator(threshold=0.6, min_frames=5, on_confirm=confirmed.append)
+    run(votes, 30, 1, 0.9, seconds=2.0)
+    assert confirmed == ['alice']
+    assert votes.confirmed['alice']['votes'] == 60
+
+def test_confirms_again_on_a_new_day():
+    confirmed = []
+    day = [date(2024, 9, 7)]
+    votes = VoteAccumulator(threshold=0.6, min_frames=5, on_confirm=confirmed.append, today=lambda: day[0])
+    run(votes, 30, 1, 0.9, seconds=2.0)
+    day[0] = date(2024, 9, 8)
+    assert votes.attendance() == []
+    run(votes, 30, 1, 0.9, seconds=2.0)
+    assert confirmed == ['alice', 'alice']
+    assert votes.attendance() == ['alice']
+
+def test_idle_people_are_evicted():
+    votes = VoteAccumulator(threshold=0.6, min_frames=20, idle_timeout=10.0)
+    votes.update([(BOX, 'alice', 90.0)], now=0.0)
+    votes.update([(BOX, 'bob', 90.0)], now=20.0)
+    assert list(votes.active) == ['bob']
+
+def test_cached_results_are_not_reported_as_encoded():
+    alice = np.full(128, 0.1)
+    image = np.random.default_rng(0).integers(0, 255, size=(120, 120, 3), dtype=np.uint8)
+    cache = EmbeddingCache(ttl=10.0, clock=lambda: 0.0)
+    fresh = []
+    for _ in range(20):
+        encoded = []
+        results = recognize_faces(image, Gallery(['alice'], alice[None, :]), cache=cache, encoded=encoded,
+                                  detect=lambda image, scale: [(20, 84, 84, 20)],
+                                  encode=lambda image, locs: [alice for _ in locs])
+        assert [name for _, name, _ in results] == ['alice']
+        fresh.extend(encoded)
+
+    assert len(fresh) == 1
+    assert (cache.hits, cache.misses) == (19, 1)
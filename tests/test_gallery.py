@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import pytest
+from gallery import IdentityGallery
+from store import FaceStore
+
+def mapped(array):
+    while array is not None and not isinstance(array, np.memmap):
+        array = array.base
+    return array is not None
+
+def store_with_templates(path, people=20, photos=3):
+    rng = np.random.default_rng(0)
+    store = FaceStore(path)
+    for person in range(people):
+        center = rng.normal(size=128)
+        for _ in range(photos):
+            store.add(f'person_{person}', center + rng.normal(scale=0.1, size=128))
+    store.save()
+    return FaceStore.open(path)
+
+def test_saved_layout_is_mapped_and_matches_the_same(tmp_path):
+    store = store_with_templates(str(tmp_path / 'store'))
+    gallery = IdentityGallery(store.names, store.embeddings)
+    gallery.save(str(tmp_path / 'layout'))
+    loaded = IdentityGallery.load(str(tmp_path / 'layout'))
+
+    assert loaded.names == gallery.names
+    assert mapped(loaded.templates) and mapped(loaded.encodings)
+    queries = np.asarray(store.embeddings[::7]) + 0.01
+    for got, expected in zip(loaded.search(queries, 3), gallery.search(queries, 3)):
+        assert np.allclose(got, expected)
+    assert IdentityGallery.load(str(tmp_path / 'missing')) is None
+
+def test_build_gallery_maps_the_layout_of_a_saved_store(tmp_path):
+    pytest.importorskip('face_recognition')
+    from faceid import build_gallery
+    path = str(tmp_path / 'store')
+    store = store_with_templates(path)
+
+    gallery = build_gallery(store)
+    assert mapped(gallery.templates)
+    assert 'gallery-1' in os.listdir(path)
+
+    store.add('newcomer', np.zeros(128))
+    assert 'newcomer' in build_gallery(store).names
+    store.save()
+    gallery = build_gallery(FaceStore.open(path))
+    assert 'newcomer' in gallery.names and mapped(gallery.templates)
+    assert sorted(name for name in os.listdir(path) if name.startswith('gallery-')) == ['gallery-2']
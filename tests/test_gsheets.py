@@ -0,0 +1,51 @@
+from datetime import date
+import pytest
+from fakesheet import FakeWorksheet
+from gsheets import check_and_update_sheet, mark_attendance_bulk, get_names_from_folder, WorksheetCache
+
+def make_folder(path, names):
+    for name in names:
+        (path / f'{name}.png').write_bytes(b'')
+    return str(path)
+
+def test_roster_names_match_enrolment(tmp_path):
+    (tmp_path / 'alice').mkdir()
+    (tmp_path / 'alice' / '1.jpg').write_bytes(b'')
+    (tmp_path / 'alice' / '2.png').write_bytes(b'')
+    (tmp_path / 'bob.jpeg').write_bytes(b'')
+    (tmp_path / 'carol.png').write_bytes(b'')
+    (tmp_path / '.downloads.json').write_bytes(b'')
+    assert sorted(get_names_from_folder(str(tmp_path))) == ['alice', 'bob', 'carol']
+
+@pytest.mark.parametrize('size', [10, 500])
+def test_empty_sheet_is_populated_in_one_write(tmp_path, limiter, size):
+    names = [f'person_{i:03d}' for i in range(size)]
+    sheet = FakeWorksheet([['Name']])
+    check_and_update_sheet(make_folder(tmp_path, names), sheet)
+    assert sheet.calls == {'col_values': 1, 'batch_update': 1}
+    assert sheet.col_values(1) == ['Name'] + names
+
+@pytest.mark.parametrize('size', [10, 500])
+def test_missing_names_are_merged_in_one_write(tmp_path, limiter, size):
+    names = [f'person_{i:03d}' for i in range(size)]
+    sheet = FakeWorksheet([['Name']] + [[name] for name in names[::2]])
+    check_and_update_sheet(make_folder(tmp_path, names), sheet)
+    assert sheet.calls == {'col_values': 1, 'batch_update': 1}
+    assert sheet.col_values(1) == ['Name'] + names
+
+def test_complete_roster_is_not_written(tmp_path, limiter):
+    names = ['alice', 'bob', 'carol']
+    sheet = FakeWorksheet([['Name']] + [[name] for name in names])
+    check_and_update_sheet(make_folder(tmp_path, names), sheet)
+    assert sheet.calls == {'col_values': 1}
+
+def test_cache_hits_spend_no_tokens(tmp_path, limiter):
+    names = ['alice', 'bob', 'carol']
+    sheet = FakeWorksheet([['Name', 'Sep 7, 2024'], ['alice']])
+    cache = WorksheetCache(sheet)
+    check_and_update_sheet(make_folder(tmp_path, names), cache)
+    assert mark_attendance_bulk(cache, ['alice', 'carol'], date(2024, 9, 7)) == ['alice', 'carol']
+    assert cache.col_values(1) == ['Name'] + names
+    # One load and two writes reached the sheet, the reads in between came from memory
+    assert sheet.calls == {'get_all_values': 1, 'batch_update': 2}
+    assert limiter.metrics()['sent'] == 3
@@ -0,0 +1,28 @@
+import os
+import numpy as np
+from index import make_index, save_index, load_index
+
+def encodings(n=200, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, 128)).astype(np.float32)
+
+def test_saved_index_round_trips(tmp_path):
+    path = str(tmp_path / 'index.npz')
+    gallery = encodings()
+    index = make_index('ivf', n_probe=4).build(gallery)
+    save_index(index, path, gallery)
+
+    loaded = load_index(path, gallery)
+    assert loaded.kind == 'ivf'
+    assert np.array_equal(loaded.order, index.order)
+    assert os.listdir(tmp_path) == ['index.npz']
+    assert load_index(path, encodings(seed=1)) is None
+
+def test_truncated_index_is_a_miss(tmp_path):
+    path = str(tmp_path / 'index.npz')
+    gallery = encodings()
+    save_index(make_index('ivf').build(gallery), path, gallery)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+    assert load_index(path, gallery) is None
+    assert load_index(str(tmp_path / 'missing.npz'), gallery) is None
@@ -0,0 +1,89 @@
+from datetime import date
+import pytest
+import gspread
+from fakesheet import FakeWorksheet
+from journal import AttendanceJournal, SheetSync
+
+HEADER = ['Name', 'Sep 7, 2024', 'Sep 8, 2024', '']
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = AttendanceJournal(str(tmp_path / 'journal.db'))
+    yield journal
+    journal.close()
+
+def make_sheet():
+    return FakeWorksheet([HEADER, ['alice'], ['bob'], ['carol']])
+
+def test_one_batched_write_per_day(journal, limiter):
+    sheet = make_sheet()
+    sync = SheetSync(journal, sheet)
+    for name in ('alice', 'bob'):
+        sync.record(name, date(2024, 9, 7))
+    sync.record('carol', date(2024, 9, 8))
+
+    assert sync.sync_once() == 3
+    assert sheet.calls == {'get_all_values': 2, 'batch_update': 2}
+    assert [sheet._get(row, 2) for row in (2, 3, 4)] == ['x', 'x', '']
+    assert sheet._get(4, 3) == 'x'
+    assert journal.pending() == []
+
+def test_recording_twice_writes_once(journal, limiter):
+    sheet = make_sheet()
+    sync = SheetSync(journal, sheet)
+    sync.record('alice', date(2024, 9, 7))
+    sync.record('alice', date(2024, 9, 7))
+    sync.sync_once()
+    assert sync.sync_once() == 0
+    assert sheet.calls['batch_update'] == 1
+
+def test_day_without_column_does_not_block_later_events(journal, limiter):
+    sheet = make_sheet()
+    sync = SheetSync(journal, sheet)
+    sync.record('alice', date(2024, 9, 6))
+    sync.record('bob', date(2024, 9, 7))
+
+    sync.sync_once()
+    assert sheet._get(3, 2) == 'x'
+    assert journal.pending() == []
+    assert [(name, day) for _, name, day, _ in journal.parked()] == [('alice', date(2024, 9, 6))]
+    assert sync.synced == 1
+    assert sync.parked == 1
+
+    # Once the column exists the parked event goes through on the next start
+    sheet._set(1, 4, 'Sep 6, 2024')
+    assert journal.unpark() == 1
+    sync.sync_once()
+    assert sheet._get(2, 4) == 'x'
+    assert journal.parked() == []
+
+def test_name_missing_from_sheet_is_parked_until_the_roster_has_it(journal, limiter):
+    sheet = make_sheet()
+    sync = SheetSync(journal, sheet)
+    sync.record('alice', date(2024, 9, 7))
+    sync.record('dave', date(2024, 9, 7))
+
+    sync.sync_once()
+    assert sheet._get(2, 2) == 'x'
+    assert journal.pending() == []
+    assert [(name, reason) for _, name, _, reason in journal.parked()] == [('dave', 'name not in sheet')]
+    assert (sync.synced, sync.parked) == (1, 1)
+
+    sheet._set(5, 1, 'dave')
+    assert journal.unpark() == 1
+    sync.sync_once()
+    assert sheet._get(5, 2) == 'x'
+    assert journal.parked() == []
+
+def test_failed_write_keeps_events_pending(journal, limiter):
+    sheet = make_sheet()
+    sync = SheetSync(journal, sheet)
+    sync.record('alice', date(2024, 9, 7))
+    sheet.fail_next(status_code=500)
+    with pytest.raises(gspread.exceptions.APIError):
+        sync.sync_once()
+    assert [name for _, name, _ in journal.pending()] == ['alice']
+
+    sync.sync_once()
+    assert sheet._get(2, 2) == 'x'
+    assert journal.pending() == []
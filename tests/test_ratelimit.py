@@ -0,0 +1,38 @@
+import pytest
+from fakesheet import FakeWorksheet
+from ratelimit import RateLimiter, RateLimitExceeded, TokenBucket, FakeClock
+
+def test_bucket_paces_after_the_burst(clock):
+    bucket = TokenBucket(rate=1.0, capacity=10, clock=clock, sleep=clock.sleep)
+    waits = [bucket.acquire() for _ in range(20)]
+    assert waits[:10] == [0.0] * 10
+    assert waits[10:] == pytest.approx([1.0] * 10)
+    assert clock() == pytest.approx(10.0)
+
+def test_limiter_stays_under_the_quota(clock):
+    limiter = RateLimiter(requests_per_minute=60, clock=clock, sleep=clock.sleep)
+    sheet = FakeWorksheet([['Name']])
+    for _ in range(70):
+        limiter.call(sheet.col_values, 1)
+    # 10 burst tokens, then one request per second
+    assert clock() == pytest.approx(60.0)
+    assert limiter.metrics() == {'sent': 70, 'throttled': 0, 'retried': 0, 'paced_seconds': 60.0}
+
+def test_rate_limited_call_backs_off_and_retries(clock):
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep, rng=lambda: 1.0)
+    sheet = FakeWorksheet([['Name'], ['alice']])
+    sheet.fail_next(3)
+    assert limiter.call(sheet.col_values, 1) == ['Name', 'alice']
+    assert clock.slept == [1.0, 2.0, 4.0]
+    assert sheet.calls['col_values'] == 4
+    assert limiter.metrics()['throttled'] == 3
+
+def test_gives_up_after_max_retries():
+    clock = FakeClock()
+    limiter = RateLimiter(max_retries=2, clock=clock, sleep=clock.sleep, rng=lambda: 0.0)
+    sheet = FakeWorksheet([['Name']])
+    sheet.fail_next(5)
+    with pytest.raises(RateLimitExceeded):
+        limiter.call(sheet.col_values, 1)
+    assert sheet.calls['col_values'] == 3
+    assert clock.slept == [0.5, 1.0]
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import cv2
+import pytest
+
+pytest.importorskip('face_recognition')
+import service
+from faceid import Face, load_database, sync_database
+
+def fake_create_face(name, image):
+    return Face(bounding_box=(0, 32, 32, 0), cropped_face=image[:32, :32], name=name,
+                feature_vector=np.full(128, 0.1))
+
+@pytest.fixture
+def recognition(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(service, 'create_face', fake_create_face)
+    os.makedirs('known_faces')
+    recognition = service.RecognitionService(load_database(), processes=1, folder='known_faces')
+    yield recognition
+    recognition.close()
+
+def photo():
+    ok, data = cv2.imencode('.png', np.zeros((64, 64, 3), dtype=np.uint8))
+    return data.tobytes()
+
+def test_enrolled_photo_survives_a_sync(recognition, capsys):
+    result = recognition.enrol('alice', photo())
+
+    filenames = os.listdir(os.path.join('known_faces', 'alice'))
+    assert len(filenames) == 1 and filenames[0].endswith('.png')
+    capsys.readouterr()
+    store = sync_database('known_faces', processes=1)
+    assert 'removed' not in capsys.readouterr().out
+    assert [entry['id'] for entry in store.entries] == [result['id']]
+    assert store.entries[0]['source'] == os.path.join('alice', filenames[0])
+
+def test_removed_identity_stays_removed_after_a_sync(recognition):
+    recognition.enrol('alice', photo())
+    recognition.remove(name='alice')
+
+    assert os.listdir(os.path.join('known_faces', 'alice')) == []
+    assert len(sync_database('known_faces', processes=1)) == 0
+
+def test_enrol_without_a_folder_is_refused(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    recognition = service.RecognitionService(load_database(), processes=1)
+    try:
+        with pytest.raises(service.ServiceError) as error:
+            recognition.enrol('alice', photo())
+        assert error.value.status == 409
+    finally:
+        recognition.close()
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('face_recognition')
+from gallery import Gallery
+from tracker import FaceTracker
+
+BOX = (20, 84, 84, 20)
+
+def textured_frame():
+    return np.random.default_rng(0).integers(0, 255, size=(120, 120, 3), dtype=np.uint8)
+
+def test_only_encoded_frames_are_reported_as_new_evidence():
+    alice = np.full(128, 0.1)
+    tracker = FaceTracker(Gallery(['alice'], alice[None, :]), keyframe_interval=10, reverify_interval=30,
+                          detect=lambda image, scale: [BOX], encode=lambda image, locs: [alice for _ in locs])
+    image = textured_frame()
+    tracked, encoded = 0, 0
+    for _ in range(60):
+        tracked += len(tracker.process(image))
+        encoded += len(tracker.encoded)
+        assert all(name == 'alice' for _, name, _ in tracker.encoded)
+
+    assert tracked == 60
+    # Frame 0 creates the track, frame 30 re-verifies it
+    assert encoded == tracker.encodings == 2
@@ -0,0 +1,156 @@
+import itertools
+import numpy as np
+import cv2
+from faceid import detect_locations, encode_locations, match_faces
+
+def iou(a, b):
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda box: (box[1] - box[3]) * (box[2] - box[0])
+    union = area(a) + area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+class Track:
+    def __init__(self, track_id, loc, name, match_percentage, encoded_at):
+        self.id = track_id
+        self.loc = loc
+        self.name = name
+        self.match_percentage = match_percentage
+        # Frame number of the encoding the name came from
+        self.encoded_at = encoded_at
+        self.points = None
+
+class FaceTracker:
+    # Runs HOG on keyframes (every keyframe_interval frames, or as soon as a track is
+    # lost) and follows faces with Lucas-Kanade optical flow in between. Detections
+    # that overlap an existing track keep its identity, only new tracks are encoded.
+    # A track's identity is re-checked on the first keyframe reverify_interval frames
+    # after its last encoding, so a box that drifted onto someone else does not keep
+    # its original name. Carried-forward names are not new evidence: only the results
+    # in self.encoded, the faces encoded on this frame, should be counted as votes.
+    def __init__(self, gallery, keyframe_interval=10, min_iou=0.3, min_points=4,
+                 threshold=0.6, unknown_threshold=0.55, detect_scale=1.0,
+                 detect=detect_locations, encode=encode_locations, reverify_interval=30):
+        self.gallery = gallery
+        self.keyframe_interval = keyframe_interval
+        self.reverify_interval = reverify_interval
+        self.min_iou = min_iou
+        self.min_points = min_points
+        self.threshold = threshold
+        self.unknown_threshold = unknown_threshold
+        self.detect_scale = detect_scale
+        self.detect = detect
+        self.encode = encode
+
+        self.tracks = []
+        self.encoded = []
+        self.track_ids = itertools.count()
+        self.prev_gray = None
+        self.force_keyframe = True
+        self.frames = 0
+        self.keyframes = 0
+        self.encodings = 0
+        self.tracks_created = 0
+        self.tracks_lost = 0
+        self.reverified = 0
+        self.identity_changes = 0
+
+    def process(self, image_test):
+        # Returns (location, name, match percentage) per tracked face, like match_faces
+        gray = cv2.cvtColor(image_test, cv2.COLOR_RGB2GRAY)
+        self.encoded = []
+        if self.force_keyframe or self.frames % self.keyframe_interval == 0:
+            self._keyframe(image_test, gray)
+        else:
+            self._follow(gray)
+        self.prev_gray = gray
+        self.frames += 1
+        return [(track.loc, track.name, track.match_percentage) for track in self.tracks]
+
+    def _keyframe(self, image_test, gray):
+        self.keyframes += 1
+        self.force_keyframe = False
+        locs_test = self.detect(image_test, self.detect_scale)
+
+        # Greedy IoU association, best overlaps first
+        pairs = sorted(((iou(track.loc, loc), i, j) for i, track in enumerate(self.tracks)
+                        for j, loc in enumerate(locs_test)), reverse=True)
+        kept, used_tracks, used_locs = [], set(), set()
+        for overlap, i, j in pairs:
+            if overlap < self.min_iou:
+                break
+            if i in used_tracks or j in used_locs:
+                continue
+            track = self.tracks[i]
+            track.loc = tuple(int(v) for v in locs_test[j])
+            kept.append(track)
+            used_tracks.add(i)
+            used_locs.add(j)
+        self.tracks_lost += len(self.tracks) - len(kept)
+
+        stale = [track for track in kept if self.frames - track.encoded_at >= self.reverify_interval]
+        new_locs = [tuple(int(v) for v in loc) for j, loc in enumerate(locs_test) if j not in used_locs]
+        locs = [track.loc for track in stale] + new_locs
+        if locs:
+            # Stale tracks and new faces go through the encoder together
+            vecs = self.encode(image_test, locs)
+            self.encodings += len(locs)
+            results = match_faces(locs, vecs, self.gallery, self.threshold, self.unknown_threshold)
+            for track, (loc, pred_name, match_percentage) in zip(stale, results):
+                if pred_name != track.name:
+                    self.identity_changes += 1
+                track.name = pred_name
+                track.match_percentage = match_percentage
+                track.encoded_at = self.frames
+            self.reverified += len(stale)
+            self.encoded = results
+            for loc, pred_name, match_percentage in results[len(stale):]:
+                kept.append(Track(next(self.track_ids), loc, pred_name, match_percentage, self.frames))
+                self.tracks_created += 1
+
+        self.tracks = kept
+        for track in self.tracks:
+            track.points = self._seed_points(gray, track.loc)
+
+    def _seed_points(self, gray, loc):
+        top, right, bottom, left = loc
+        roi = gray[top:bottom, left:right]
+        points = None
+        if roi.size:
+            points = cv2.goodFeaturesToTrack(roi, maxCorners=30, qualityLevel=0.01, minDistance=5)
+        if points is None:
+            # Flat patch, fall back to a small grid over the box
+            ys, xs = np.mgrid[0.25:0.76:0.25, 0.25:0.76:0.25]
+            points = np.stack([xs.ravel() * (right - left), ys.ravel() * (bottom - top)], axis=1)
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        return points + np.array([left, top], dtype=np.float32)
+
+    def _follow(self, gray):
+        height, width = gray.shape[:2]
+        kept = []
+        for track in self.tracks:
+            next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, track.points, None)
+            good = status.ravel() == 1
+            if good.sum() < self.min_points:
+                continue
+            dx, dy = np.median((next_points - track.points)[good].reshape(-1, 2), axis=0)
+            top, right, bottom, left = track.loc
+            top, bottom = int(round(top + dy)), int(round(bottom + dy))
+            left, right = int(round(left + dx)), int(round(right + dx))
+            if right <= 0 or bottom <= 0 or left >= width or top >= height:
+                continue
+            track.loc = (top, right, bottom, left)
+            track.points = next_points[good].reshape(-1, 1, 2)
+            kept.append(track)
+
+        if len(kept) < len(self.tracks):
+            self.tracks_lost += len(self.tracks) - len(kept)
+            self.force_keyframe = True
+        self.tracks = kept
+
+    def stats(self):
+        return {'frames': self.frames, 'keyframes': self.keyframes,
+                'keyframe_ratio': self.keyframes / self.frames if self.frames else 0.0,
+                'encodings': self.encodings, 'tracks_created': self.tracks_created,
+                'tracks_lost': self.tracks_lost, 'reverified': self.reverified,
+                'identity_changes': self.identity_changes}